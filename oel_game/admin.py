@@ -13,6 +13,19 @@ class GameLogInline(admin.TabularInline):
     fields = ('id', 'executor_id', 'command')
 
 
+class AwaitingFilter(admin.SimpleListFilter):
+    title = 'awaiting'
+    parameter_name = 'awaiting'
+
+    def lookups(self, request, model_admin):
+        return (('me', 'My turn'), )
+
+    def queryset(self, request, queryset):
+        if self.value() == 'me':
+            return queryset & Game.objects.awaiting(request.user)
+        return queryset
+
+
 class GameAdmin(admin.ModelAdmin):
     fieldsets = [
         (None, {'fields': ['owner', 'name', 'seed']}),
@@ -20,14 +33,23 @@ class GameAdmin(admin.ModelAdmin):
 #        ('Date information',    {'fields': ['pub_date']}),
     ]
     inlines = [SeatInline, GameLogInline]
-    list_display = ('name', 'owner', 'phase', 'round')
+    # The summary columns, since the gamestate properties would build every listed game
+    list_display = ('name', 'owner', 'summary_phase', 'summary_round')
+    list_select_related = ('owner', )
+    list_filter = (AwaitingFilter, 'summary_phase')
     readonly_fields = ('seed', 'phase', 'message', 'round', 'turn', 'last_applied_gamelog', 'action_seat', 'seats')
 #    list_filter = ['pub_date']
 #    search_fields = ['name']
 
 
 class GameLogAdmin(admin.ModelAdmin):
-    list_display = ('game', 'executor_id', 'command')
+    list_display = ('game_name', 'executor_id', 'command')
+    list_select_related = ('game', )
+
+    def game_name(self, obj):
+        # Game.__str__ needs the gamestate, which would mean a full replay for every row
+        return obj.game.name
+    game_name.short_description = 'game'
 
 
 # Register your models here.
@@ -0,0 +1,170 @@
+__author__ = 'Jurek'
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.signals import post_save, post_delete
+
+from .exceptions import OeLException, OeLSyntaxError, OeLValueError
+from .models import Game, Seat, GameLog
+
+
+class GameCache(object):
+    """
+    Process-local LRU cache of fully built Game instances.  A cached game is only handed out after checking the
+    version of it (see GameManager.versions()).  If the log has advanced, only the new entries get replayed onto the
+    cached state; if seats were taken (or left) or the game was saved in another process, the game gets built again.
+
+    Every thread gets the same instance of a game, so anything that reads or changes it has to hold game_lock() for
+    it, most simply through locked().  The cache's own lock only covers the LRU bookkeeping, so loading one game
+    doesn't hold up the others.
+    """
+    # Games share a fixed number of locks, so that there's no per-game lock to clean up
+    lock_count = 64
+
+    def __init__(self, max_size=None):
+        self._max_size = max_size
+        self._games = OrderedDict()
+        self._lock = threading.RLock()
+        self._game_locks = [threading.RLock() for i in range(self.lock_count)]
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return getattr(settings, 'OEL_GAME_CACHE_SIZE', 100)
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def __len__(self):
+        return len(self._games)
+
+    def __contains__(self, pk):
+        return pk in self._games
+
+    @staticmethod
+    def latest_gamelog_ids(pks):
+        """
+        :return: dict of game pk -> newest GameLog id, in a single query
+        """
+        # GameLog's default ordering would otherwise end up in the GROUP BY
+        rows = GameLog.objects.filter(game_id__in=pks).order_by().values('game_id').annotate(latest=Max('id'))
+        return {row['game_id']: row['latest'] for row in rows}
+
+    def game_lock(self, pk):
+        """
+        :return: the reentrant lock that has to be held while using the cached instance of the game
+        """
+        return self._game_locks[int(pk) % self.lock_count]
+
+    @contextmanager
+    def locked(self, pk):
+        """
+        Hands out the built Game for pk with its lock held until the with block ends
+        :raises Game.DoesNotExist: if there's no such game
+        """
+        with self.game_lock(pk):
+            yield self.get(pk)
+
+    def get(self, pk):
+        """
+        :return: the built Game for pk.  The caller has to hold game_lock() while using it.
+        :raises Game.DoesNotExist: if there's no such game
+        """
+        pk = int(pk)
+        return self._get(pk, Game.objects.versions([pk]).get(pk, (0, 0, None)))
+
+    def get_many(self, pks):
+        """
+        Each game is only locked while it's being checked and brought up to date; no locks are held once this returns.
+        :return: list of built Games, in the same order as pks.  Games that don't exist are left out.  Callers have to
+            take game_lock() (or locked()) for each game themselves before reading or changing it.
+        """
+        pks = [int(pk) for pk in pks]
+        versions = Game.objects.versions(pks)
+        # The games that aren't cached get read along with their seats and GameLogs in a fixed number of queries
+        with self._lock:
+            missing = [pk for pk in pks if pk not in self._games]
+        loaded = Game.objects.in_bulk_for_replay(missing)
+        games = []
+        for pk in pks:
+            if pk not in versions:
+                continue
+            try:
+                games.append(self._get(pk, versions[pk], loaded.get(pk)))
+            except Game.DoesNotExist:
+                pass
+        return games
+
+    def _get(self, pk, version, loaded=None):
+        latest_gamelog, seats_taken, updated = version
+        # Replaying only holds up the threads that want the same game
+        with self.game_lock(pk):
+            with self._lock:
+                game = self._games.pop(pk, None)
+            # Refreshing only reads new GameLog entries, not the seats or the Game row
+            if game is not None and (game.updated != updated or
+                                     sum(1 for s in game.seats if s.player_id is not None) != seats_taken):
+                game = None
+            # An archived game never changes, and its GameLog rows are gone, so there's nothing to check
+            if game is not None and not game.archived:
+                known_gamelog = game.gamelogs[-1].id if game.gamelogs else 0
+                if latest_gamelog > known_gamelog:
+                    try:
+                        game.refresh_gamestate()
+                    except (OeLException, OeLSyntaxError, OeLValueError):
+                        # Let a fresh instance record the failure the same way a normal load does
+                        game = None
+                elif latest_gamelog < known_gamelog:
+                    # The log went backwards, so the cached state can't be trusted anymore
+                    game = None
+
+            hit = game is not None
+            if not hit:
+                game = loaded or Game.objects.for_replay().get(pk=pk)
+                game.load_gamestate()
+
+            with self._lock:
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                self._games[pk] = game
+                while len(self._games) > self.max_size:
+                    self._games.popitem(last=False)
+            return game
+
+    def evict(self, pk):
+        with self._lock:
+            self._games.pop(int(pk), None)
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+game_cache = GameCache()
+
+
+# Joining or leaving a seat doesn't add a GameLog entry, so the cached game has to be dropped explicitly
+def _evict_seat_game(sender, instance, **kwargs):
+    game_cache.evict(instance.game_id)
+
+
+# Renaming a game or editing it in the admin doesn't add a GameLog entry either
+def _evict_game(sender, instance, **kwargs):
+    game_cache.evict(instance.pk)
+
+post_save.connect(_evict_game, sender=Game, dispatch_uid='oel_game.cache.game_saved')
+post_save.connect(_evict_seat_game, sender=Seat, dispatch_uid='oel_game.cache.seat_saved')
+post_delete.connect(_evict_seat_game, sender=Seat, dispatch_uid='oel_game.cache.seat_deleted')
+post_delete.connect(_evict_game, sender=Game, dispatch_uid='oel_game.cache.game_deleted')
@@ -15,19 +15,42 @@ from .cards.function import BuildBuilding as fnBuildBuilding, FellTrees as fnFel
 from .objects import LedgerEntry
 from .goods import Wine, Whiskey, Malt, Beer, Grapes, Flour, Bread, goods_map
 
+# Upper bound for the number of distinct command texts remembered by Command.parse_cached()
+PARSE_CACHE_SIZE = 10000
+_parse_cache = {}
+
+
+class StructuredMatch(object):
+    """
+    Stands in for a match_regex match when a command is rebuilt from its structured form, so that the command's
+    validate() can read its groups the same way
+    """
+    def __init__(self, groups):
+        self._groups = groups
+
+    def group(self, name):
+        return self._groups.get(name)
+
+    def groupdict(self):
+        return dict(self._groups)
+
 
 class Command(object):
     __metaclass__ = ABCMeta
     match_regex = re.compile(r'^.*$')
 
-    def __init__(self, game, executor_id, command_string):
+    def __init__(self, game, executor_id, command_string, trusted=False, match=None):
         super(Command, self).__init__()
         self._is_partial = False
         self.parent_command = None
         self.game = game
         self._executor_id = executor_id
         self.command_string = command_string
-        self.match = self.match_regex.match(self.command_string)
+        # command_factory() has already matched the string while picking the class
+        self.match = match or self.match_regex.match(self.command_string)
+        # A trusted command is being replayed from a GameLog entry that has already been applied successfully once, so
+        # the checks that can't change the outcome of the command are skipped
+        self.trusted = trusted
 
     @property
     def is_partial(self):
@@ -44,9 +67,7 @@ class Command(object):
     @property
     def executor_index(self):
         if self._executor_id:
-            for index in range(len(self.game.seats)):
-                if self.game.seats[index].pk == self._executor_id:
-                    return index
+            return self.game.seat_index(self._executor_id)
         return None
 
     @property
@@ -58,6 +79,8 @@ class Command(object):
 
     @abstractmethod
     def validate(self):
+        if self.trusted:
+            return
         if self.allowed_phases and self.game.phase not in self.allowed_phases:
             raise InvalidOpCode("'{0}' not valid in {1}".format(self.command_string, self.game.phase))
         if not self.needs_executor and self.executor:
@@ -76,13 +99,72 @@ class Command(object):
     def finalize_apply(self):
         pass
 
+    @staticmethod
+    def parse(command_string):
+        """
+        Finds the command class for a command string by its leading verb
+        :param command_string: stripped, lowercase command text
+        :return: (command class, match of its match_regex)
+        """
+        if command_string.startswith(comment_prefixes):
+            return Comment, Comment.match_regex.match(command_string)
+        verb = command_string.split(None, 1)[0] if command_string else ''
+        for command_class in command_verbs.get(verb, ()):
+            match = command_class.match_regex.match(command_string)
+            if match:
+                return command_class, match
+        raise InvalidArguments(command_string)
+
+    @classmethod
+    def parse_cached(cls, command_text):
+        """
+        Same as parse(), for the raw text of one command in a GameLog entry.  Committed entries never change, so the
+        result is remembered for the whole process and replaying the same text again skips parsing entirely.
+        :param command_text: command text as stored, not yet stripped or lowercased
+        :return: (command string, command class, match of its match_regex)
+        """
+        parsed = _parse_cache.get(command_text)
+        if parsed is None:
+            command_string = command_text.strip().lower()
+            parsed = (command_string, ) + cls.parse(command_string)
+            if len(_parse_cache) >= PARSE_CACHE_SIZE:
+                # Dropping everything is crude, but the cache refills from the games that are actually being played
+                _parse_cache.clear()
+            _parse_cache[command_text] = parsed
+        return parsed
+
+    @classmethod
+    def structure(cls, command_text):
+        """
+        Breaks a command down into plain data: its verb, command class and the named groups of its match_regex (building
+        id, coordinates, goods, clergy, payment...).  Arguments that get passed on to a card's function are kept as the
+        text the function parses.
+        :param command_text: raw text of a single command
+        :return: dict that can be serialized to JSON, and turned back into a command with from_structured()
+        """
+        command_string, command_class, match = cls.parse_cached(command_text)
+        return {
+            'command': command_string,
+            'verb': 'comment' if command_class is Comment else command_string.split(None, 1)[0],
+            'type': command_class.__name__,
+            'arguments': {name: value for name, value in match.groupdict().items() if value is not None}
+        }
+
+    @staticmethod
+    def from_structured(structured):
+        """
+        :param structured: dict created by structure()
+        :return: (command string, command class, match stand-in)
+        """
+        command_class = command_types.get(structured['type'])
+        if command_class is None:
+            raise InvalidArguments(structured['command'])
+        return structured['command'], command_class, StructuredMatch(structured['arguments'])
+
     @classmethod
-    def command_factory(cls, game, executor_id, command_string):
-        for (match_string, command_class) in command_map:
-            if re.match(match_string, command_string):
-                return command_class(game, executor_id, command_string)
-        else:
-            raise InvalidArguments(command_string)
+    def command_factory(cls, game, executor_id, command_string, trusted=False):
+        command_class, match = cls.parse(command_string)
+        return command_class(game, executor_id, command_string, trusted=trusted, match=match)
 
 
 class ExecutorCommand(Command):
@@ -150,6 +232,8 @@ class Option(Command):
         super(Option, self).validate()
 
         self.option = self.match.group('option')
+        if self.trusted:
+            return
 
         if self.option == 'one-player':
             if self.game.number_of_players in (1, ):
@@ -240,6 +324,8 @@ class Setup(Command):
 
         self.keyword = self.match.group('keyword')
         self.parameter = self.match.group('parameter')
+        if self.trusted:
+            return
 
         if self.keyword == 'variant':
             if self.parameter in ('france', 'ireland'):
@@ -277,6 +363,7 @@ class Setup(Command):
                 seats = self.game.seats
                 for i in range(len(seats)):
                     seats[i].seat_order = new_seating_order[i]
+                self.game.order_seats()
 
             house_index = 0
             if self.game.number_of_players == 1:
@@ -334,6 +421,8 @@ class Convert(ExecutorCommand):
         self.convert_from = self.match.group('convert_from')
         self.amount_to = int(self.match.group('amount_to'))
         self.convert_to = self.match.group('convert_to')
+        if self.trusted:
+            return
 
         if self.convert_from in self.executor.goods and self.convert_to in self.executor.goods:
             if self.executor.goods[self.convert_from] < self.amount_from:
@@ -400,6 +489,8 @@ class BuyLandscape(ExecutorCommand):
         self.landscape_type = self.match.group('landscape_type').capitalize()
         self.side = self.landscape_map.get(self.landscape_type, {}).get(self.match.group('side'), None)
         self.row = int(self.match.group('row'))
+        if self.trusted:
+            return
 
         if self.executor.landscape_purchased_this_turn:
             raise LandscapeAlreadyPurchased()
@@ -465,7 +556,7 @@ class BuildBuilding(Action):
         super(BuildBuilding, self).apply(previous_command)
 
         function = fnBuildBuilding()
-        validation = Validation(remaining_arguments=self.command_string)
+        validation = Validation(remaining_arguments=self.command_string, trusted=self.trusted)
         validation.update(function.execute(self.executor, validation))
 
         if not validation.success:
@@ -505,7 +596,7 @@ class BuildSettlement(Action):
         super(BuildSettlement, self).apply(previous_command)
 
         function = fnBuildSettlement()
-        validation = Validation(remaining_arguments=self.command_string)
+        validation = Validation(remaining_arguments=self.command_string, trusted=self.trusted)
         validation.update(function.execute(self.executor, validation))
 
         if not validation.success:
@@ -530,6 +621,8 @@ class Pass(ExecutorCommand):
 
     def validate(self):
         super(Pass, self).validate()
+        if self.trusted:
+            return
 
         # Actions are a MUST in these Action phases but the player is not required to build a settlement during the
         # Settlement phase
@@ -588,7 +681,7 @@ class FellTrees(Action):
         super(FellTrees, self).apply(previous_command)
 
         function = fnFellTrees()
-        validation = Validation(remaining_arguments=self.command_string)
+        validation = Validation(remaining_arguments=self.command_string, trusted=self.trusted)
         validation.update(function.execute(self.executor, validation))
 
         if not validation.success:
@@ -629,7 +722,7 @@ class CutPeat(Action):
         super(CutPeat, self).apply(previous_command)
 
         function = fnCutPeat()
-        validation = Validation(remaining_arguments=self.command_string)
+        validation = Validation(remaining_arguments=self.command_string, trusted=self.trusted)
         validation.update(function.execute(self.executor, validation))
 
         if not validation.success:
@@ -777,7 +870,7 @@ class UseBuilding(Action):
             self.owner = self.executor
             # Mode #3 is always partial, since the player whose turn it is still needs to use the building
             self._is_partial = True
-            self.game.action_seat_index = self.game.seats.index(self.parent_command.executor)
+            self.game.action_seat_index = self.game.seat_index(self.parent_command.executor.pk)
 
             matching_clergy = [c for c in self.executor.clergy_pool if c.name == contract_clergy]
             if not matching_clergy:
@@ -806,7 +899,7 @@ class UseBuilding(Action):
                 self.owner.goods[self.payment.name] += self.payment
 
             if self._is_partial:
-                self.game.action_seat_index = self.game.seats.index(self.owner)
+                self.game.action_seat_index = self.game.seat_index(self.owner.pk)
             else:
                 # Assign the clergyman to the building
                 self.owner.clergy_pool.remove(self.clergy)
@@ -828,7 +921,7 @@ class UseBuilding(Action):
                 arguments = 'use {0} to {1}'.format(self.building.id, self.arguments)
             else:
                 arguments = 'use {0}'.format(self.building.id)
-            validation = Validation(remaining_arguments=arguments)
+            validation = Validation(remaining_arguments=arguments, trusted=self.trusted)
             validation.update(function.execute(self.executor, validation))
 
             if not validation.success:
@@ -881,18 +974,24 @@ class Continuation(Action):
         self.parent_command.finalize_apply()
 
 
-command_map = [
-    (r'^#.*$', Comment),
-    (r'^//.*$', Comment),
-    (r'^option\s+.+$',  Option),
-    (r'^setup\s+.+$',  Setup),
-    (r'^convert\s+.+$',  Convert),
-    (r'^buy\s+.+$',  BuyLandscape),
-    (r'^build\s+[gfi].+$',  BuildBuilding),
-    (r'^build\s+s.+$',  BuildSettlement),
-    (r'^pass$',  Pass),
-    (r'^fell-trees\s+.+$',  FellTrees),
-    (r'^cut-peat\s+.+$',  CutPeat),
-    (r'^place|pay\s+.+$',  UseBuilding),
-    (r'^use.+$', Continuation),
-]
\ No newline at end of file
+comment_prefixes = ('#', '//')
+
+# Leading verb -> the command classes that start with it.  Each class' match_regex is the full grammar, so the string
+# only gets matched against the classes sharing its verb.
+command_verbs = {
+    'option': (Option, ),
+    'setup': (Setup, ),
+    'convert': (Convert, ),
+    'buy': (BuyLandscape, ),
+    'build': (BuildBuilding, BuildSettlement),
+    'pass': (Pass, ),
+    'fell-trees': (FellTrees, ),
+    'cut-peat': (CutPeat, ),
+    'place': (UseBuilding, ),
+    'pay': (UseBuilding, ),
+    'use': (Continuation, ),
+}
+
+command_types = {command_class.__name__: command_class
+                 for command_classes in command_verbs.values() for command_class in command_classes}
+command_types[Comment.__name__] = Comment
\ No newline at end of file
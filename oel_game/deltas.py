@@ -0,0 +1,92 @@
+__author__ = 'Jurek'
+
+# Scalar pieces of the game's state that get reported as a whole when they change
+STATUS_ATTRIBUTES = ('phase', 'round', 'turn', 'age', 'action_seat_index')
+
+
+def _space_state(space):
+    cards = [card.id for card in space.all_cards]
+    clergy = [[c.owner.pk, c.name] for card in space.all_cards for c in getattr(card, 'assigned_clergy', ())]
+    return {'cards': cards, 'clergy': clergy} if clergy else {'cards': cards}
+
+
+def _seat_state(seat):
+    spaces = {}
+    for landscape in [seat.heartland] + seat.landscapes:
+        for column in range(landscape.horizontal_size):
+            for row in range(landscape.vertical_size):
+                space = landscape[column][row]
+                # Mountain Plots are missing their last space
+                if space:
+                    coordinate = '{0}{1}'.format(landscape.row + row, chr(97 + landscape.column + column))
+                    spaces[coordinate] = _space_state(space)
+    return {
+        'goods': {g.name: g.count for g in seat.goods.values()},
+        'clergy_pool': sorted(c.name for c in seat.clergy_pool),
+        'spaces': spaces
+    }
+
+
+def capture_gamestate(game):
+    """
+    Takes a plain-data picture of the parts of a game that commands change, to be compared with diff_gamestate()
+    :param game: built Game
+    :return: dict
+    """
+    return {
+        'status': {name: getattr(game, name) for name in STATUS_ATTRIBUTES},
+        'gameboard': dict(game.gameboard),
+        'available_buildings': [b.id for b in game.available_buildings],
+        'available_landscapes': {t: len(l) for t, l in game.available_landscapes.items()},
+        'seats': {s.pk: _seat_state(s) for s in game.seats},
+        'ledger_length': len(game.ledger)
+    }
+
+
+def _changed(before, after):
+    return {key: value for key, value in after.items() if before.get(key) != value}
+
+
+def diff_gamestate(before, after, ledger):
+    """
+    Works out what changed between two captures of the same game.  Only the parts that changed are in the result:
+    'status', 'gameboard' and 'available_landscapes' map to their new values, 'available_buildings' to the building ids
+    added and removed, 'seats' to the new goods counts, clergy pool and space contents per seat pk, and 'ledger' to the
+    entries that were added.
+    :param before: capture_gamestate() before applying the command
+    :param after: capture_gamestate() after applying the command
+    :param ledger: the game's ledger
+    :return: dict that can be serialized to JSON
+    """
+    delta = {}
+    for name in ('status', 'gameboard', 'available_landscapes'):
+        changed = _changed(before[name], after[name])
+        if changed:
+            delta[name] = changed
+
+    added = [b for b in after['available_buildings'] if b not in before['available_buildings']]
+    removed = [b for b in before['available_buildings'] if b not in after['available_buildings']]
+    if added or removed:
+        delta['available_buildings'] = {'added': added, 'removed': removed}
+
+    seats = {}
+    for pk, seat_after in after['seats'].items():
+        seat_before = before['seats'].get(pk, {'goods': {}, 'clergy_pool': None, 'spaces': {}})
+        seat_delta = {}
+        goods = _changed(seat_before['goods'], seat_after['goods'])
+        if goods:
+            seat_delta['goods'] = goods
+        if seat_before['clergy_pool'] != seat_after['clergy_pool']:
+            seat_delta['clergy_pool'] = seat_after['clergy_pool']
+        spaces = _changed(seat_before['spaces'], seat_after['spaces'])
+        if spaces:
+            seat_delta['spaces'] = spaces
+        if seat_delta:
+            seats[pk] = seat_delta
+    if seats:
+        delta['seats'] = seats
+
+    entries = ledger[before['ledger_length']:after['ledger_length']]
+    if entries:
+        delta['ledger'] = [{'text': e.text, 'executor_index': e.executor_index} for e in entries]
+    return delta
@@ -164,3 +164,10 @@ class FunctionJoiner(object):
     And = 'And'
     AndThen = 'And Then'
     Or = 'Or'
+
+
+class ReplayMode(object):
+    # Commands that have been applied successfully before only get their state changes replayed
+    Trusted = 'Trusted'
+    # Every command is validated again, e.g. after the rules have changed
+    Verify = 'Verify'
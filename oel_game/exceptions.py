@@ -53,6 +53,35 @@ class UnappliedCommandsError(OeLException):
     pass
 
 
+class GameLogConflict(UnappliedCommandsError):
+    """
+    Another instance of the game appended GameLog entries first.  Catching up with refresh_gamestate() and trying
+    again is enough.
+    """
+    pass
+
+
+class CommandQueueTimeout(OeLException):
+    pass
+
+
+class GameArchived(OeLException):
+    """
+    The game's GameLog has been packed into a GameArchive, so no more entries can be added
+    """
+    pass
+
+
+class CommandBatchError(OeLException):
+    """
+    A command in a batch failed to apply.  index is its position in the batch and error is what it raised.
+    """
+    def __init__(self, index, error):
+        super(CommandBatchError, self).__init__('command {0} failed: {1}'.format(index, error))
+        self.index = index
+        self.error = error
+
+
 class NoLandscapeAvailable(OeLException):
     pass
 
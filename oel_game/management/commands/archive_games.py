@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...enums import Phase
+from ...exceptions import GameLogConflict
+from ...models import Game
+
+
+class Command(BaseCommand):
+    help = 'Packs the GameLog of finished games into a single compressed row per game'
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_ids', nargs='*', type=int, help='Games to archive (default: every finished game)')
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=100,
+                            help='Number of games read from the database at a time')
+
+    def handle(self, *args, **options):
+        games = Game.objects.filter(summary_phase=Phase.Endgame, archived=False)
+        if options['game_ids']:
+            games = games.filter(pk__in=options['game_ids'])
+        pks = list(games.order_by('pk').values_list('pk', flat=True))
+
+        batch_size = max(options['batch_size'], 1)
+        archived = gamelogs = gamelog_size = state_size = 0
+        start = time.time()
+        for offset in range(0, len(pks), batch_size):
+            batch = pks[offset:offset + batch_size]
+            loaded = Game.objects.in_bulk_for_replay(batch)
+            for pk in batch:
+                game = loaded[pk]
+                game.load_gamestate()
+                if game.phase != Phase.Endgame:
+                    self.stdout.write('{0} (#{1}) is in {2}, skipped'.format(game, pk, game.phase))
+                    continue
+                try:
+                    archive = game.archive()
+                except GameLogConflict:
+                    self.stdout.write('{0} (#{1}) changed while archiving, skipped'.format(game, pk))
+                    continue
+                archived += 1
+                gamelogs += archive.gamelog_count
+                gamelog_size += len(archive.gamelog)
+                state_size += len(archive.state)
+
+        elapsed = time.time() - start
+        rate = archived / elapsed if elapsed else 0.0
+        self.stdout.write('{0} game(s) archived, {1} GameLog entries packed into {2} bytes plus {3} bytes of final '
+                          'state, in {4:.2f}s ({5:.1f} games/s)'.format(archived, gamelogs, gamelog_size, state_size,
+                                                                        elapsed, rate))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import GameLog
+
+
+class Command(BaseCommand):
+    help = 'Fills in the structured form of GameLog commands that were saved without one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_ids', nargs='*', type=int, help='Games to backfill (default: all of them)')
+        parser.add_argument('--batch-size', type=int, default=1000, dest='batch_size',
+                            help='Number of GameLog entries updated per transaction')
+        parser.add_argument('--force', action='store_true', dest='force', default=False,
+                            help='Rebuild the structured form of every entry, e.g. after the command grammar changed')
+
+    def handle(self, *args, **options):
+        gamelogs = GameLog.objects.order_by('id')
+        if options['game_ids']:
+            gamelogs = gamelogs.filter(game_id__in=options['game_ids'])
+        if not options['force']:
+            gamelogs = gamelogs.filter(structured_command='')
+
+        updated = unparsable = 0
+        last_id = 0
+        while True:
+            batch = list(gamelogs.filter(id__gt=last_id).values_list('id', 'command')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            # Entries with the same text share one update
+            by_structure = {}
+            for gamelog_id, command in batch:
+                structured = GameLog.structure_command(command)
+                if not structured:
+                    unparsable += 1
+                by_structure.setdefault(structured, []).append(gamelog_id)
+            with transaction.atomic():
+                for structured, gamelog_ids in by_structure.items():
+                    updated += GameLog.objects.filter(id__in=gamelog_ids).update(structured_command=structured)
+
+        self.stdout.write('{0} GameLog entries updated, {1} could not be parsed'.format(updated, unparsable))
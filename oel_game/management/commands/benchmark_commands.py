@@ -0,0 +1,56 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from ...commands import Command as GameCommand
+from ...models import GameLog
+
+SAMPLE_COMMANDS = (
+    '# game actions',
+    'setup finalize',
+    'option short-game',
+    'place prior to use h01 to choose clay',
+    'pay 1 coin to red to use g01 to convert 1 wood to 1 energy',
+    'place lay-brother',
+    'use g01 to choose wood',
+    'build g02 at 31c and place prior',
+    'build s01 at 32c with 1 wood 2 food',
+    'fell-trees at 30d to choose joker',
+    'cut-peat at 30c to choose peat',
+    'convert 1 grain to 1 straw',
+    'buy district as side1 at 4',
+    'pass',
+)
+
+
+class Command(BaseCommand):
+    help = 'Measures how fast command strings get parsed into command classes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200000, help='Number of commands to parse per run')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs; the fastest one is reported')
+        parser.add_argument('--from-db', action='store_true', dest='from_db', default=False,
+                            help='Parse the commands stored in the GameLog instead of the built-in sample')
+
+    def handle(self, *args, **options):
+        commands = SAMPLE_COMMANDS
+        if options['from_db']:
+            commands = [text.strip().lower()
+                        for command in GameLog.objects.values_list('command', flat=True)
+                        for text in command.split(';')]
+            if not commands:
+                self.stderr.write('No GameLog entries to parse')
+                return
+
+        # Cycle through the corpus so that every run parses the same number of commands
+        count = options['count']
+        corpus = (list(commands) * (count // len(commands) + 1))[:count]
+
+        def parse():
+            for text in corpus:
+                GameCommand.parse(text)
+
+        elapsed = min(timeit.repeat(parse, number=1, repeat=options['repeat']))
+        self.stdout.write('{0} commands ({1} distinct) in {2:.3f}s'.format(count, len(set(commands)), elapsed))
+        self.stdout.write('{0:,.0f} commands/s, {1:.2f}s per million commands'.format(
+            count / elapsed, elapsed * 1000000 / count))
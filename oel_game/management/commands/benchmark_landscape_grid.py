@@ -0,0 +1,68 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from ...cards import buildings
+from ...enums import DistrictSide, PlotSide
+from ...landscapes import District, Plot
+from ...models import Seat
+from ...serializers import LandscapeSerializer, LandscapeGridSerializer
+
+
+def expanded_seats(seat_count=4):
+    """
+    Builds unsaved seats with every District and Plot bought (on alternating sides) and every empty space that can take
+    a building filled with one
+    """
+    building_pool = sorted(buildings, key=lambda b: b().id)
+    seats = []
+    for i in range(seat_count):
+        seat = Seat()
+        for n in range(1, 10):
+            district = District(n, 0)
+            district.landscape_side = (DistrictSide.MoorForestForestHillsideHillside,
+                                       DistrictSide.ForestPlainsPlainsPlainsHillside)[n % 2]
+            district.row = 30 + (n + 1) // 2 * (1 if n % 2 else -1)
+            plot = Plot(n, 0)
+            plot.landscape_side = (PlotSide.Coastal, PlotSide.Mountain)[n % 2]
+            plot.row = 22 + n * 2
+            seat.landscapes.extend([district, plot])
+
+        for landscape in [seat.heartland] + seat.landscapes:
+            for column in landscape.landscape_spaces:
+                for space in column:
+                    if space is None or space.card:
+                        continue
+                    for building_class in building_pool:
+                        building = building_class(owner=seat)
+                        if space.landscape_plot in building.landscapes:
+                            space.add_card(building)
+                            break
+        seats.append(seat)
+    return seats
+
+
+class Command(BaseCommand):
+    help = 'Compares the plain-dict landscape renderer with the nested DRF serializers on a fully expanded board'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seats', type=int, default=4, help='Number of seats on the board')
+        parser.add_argument('--number', type=int, default=50, help='Number of boards serialized per run')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs; the fastest one is reported')
+
+    def handle(self, *args, **options):
+        grids = [seat.landscape_grid for seat in expanded_seats(options['seats'])]
+
+        def nested():
+            for grid in grids:
+                for column in ('column_0', 'column_1', 'column_2'):
+                    for landscape in grid[column]:
+                        LandscapeSerializer().to_representation(landscape)
+
+        def rendered():
+            for grid in grids:
+                LandscapeGridSerializer().to_representation(grid)
+
+        for name, func in (('nested serializers', nested), ('plain-dict renderer', rendered)):
+            elapsed = min(timeit.repeat(func, number=options['number'], repeat=options['repeat'])) / options['number']
+            self.stdout.write('{0}: {1:.2f}ms per board'.format(name, elapsed * 1000))
@@ -0,0 +1,52 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Game, Seat
+from ...queryplans import explain
+
+
+def hot_queries(game):
+    """
+    :return: list of (name, queryset) for the queries that run on every game load, join and lookup
+    """
+    return [
+        ('gamelogs', game.gamelog_set.all()),
+        ('last gamelog', game.gamelog_set.reverse()[:1]),
+        ('open seat', game.seat_set.players().select_for_update().filter(player__isnull=True)[:1]),
+        ('owned games', Game.objects.filter(owner_id=game.owner_id)),
+        ('player seats', Seat.objects.filter(player_id=game.owner_id)),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Measures the hot GameLog and Seat queries over a sample of the games in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=200, help='Number of games to run the queries for')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs; the fastest one is reported')
+        parser.add_argument('--plans', action='store_true', dest='plans', default=False,
+                            help='Print the query plans as well')
+
+    def handle(self, *args, **options):
+        # Spread over the whole table rather than the oldest games
+        pks = list(Game.objects.order_by('?').values_list('pk', flat=True)[:options['games']])
+        games = list(Game.objects.filter(pk__in=pks))
+        if not games:
+            self.stderr.write('No games to query')
+            return
+
+        samples = [hot_queries(game) for game in games]
+        for index, (name, queryset) in enumerate(samples[0]):
+            def run():
+                # select_for_update() needs a transaction
+                with transaction.atomic():
+                    for queries in samples:
+                        list(queries[index][1].all())
+
+            elapsed = min(timeit.repeat(run, number=1, repeat=options['repeat']))
+            self.stdout.write('{0}: {1:.3f}ms per query'.format(name, elapsed * 1000 / len(samples)))
+            if options['plans']:
+                for line in explain(queryset):
+                    self.stdout.write('    {0}'.format(line))
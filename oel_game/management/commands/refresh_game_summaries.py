@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Game
+
+
+class Command(BaseCommand):
+    help = 'Builds games to fill in their summary columns, e.g. for games created before the columns existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_ids', nargs='*', type=int, help='Games to refresh (default: all of them)')
+        parser.add_argument('--all', action='store_true', dest='all', default=False,
+                            help='Refresh every game, not just the ones without a summary')
+
+    def handle(self, *args, **options):
+        games = Game.objects.all()
+        if options['game_ids']:
+            games = games.filter(pk__in=options['game_ids'])
+        elif not options['all']:
+            games = games.filter(summary_phase='')
+
+        count = 0
+        for game in games.iterator():
+            # Building the game writes its summary
+            game.load_gamestate()
+            count += 1
+        self.stdout.write('{0} game summaries refreshed'.format(count))
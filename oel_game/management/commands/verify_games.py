@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from ...enums import Phase, ReplayMode
+from ...models import Game
+
+
+class Command(BaseCommand):
+    help = 'Replays games with every command validated again, and reports the ones that no longer apply'
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_ids', nargs='*', type=int, help='Games to verify (default: all of them)')
+        parser.add_argument('--reset', action='store_true', dest='reset', default=False,
+                            help='Move the verified mark of broken games back, so they get validated on every load')
+
+    def handle(self, *args, **options):
+        games = Game.objects.all()
+        if options['game_ids']:
+            games = games.filter(pk__in=options['game_ids'])
+
+        broken = 0
+        for game in games.iterator():
+            game.replay_mode = ReplayMode.Verify
+            game.load_gamestate()
+            if game.phase != Phase.Broken:
+                continue
+
+            broken += 1
+            self.stdout.write('{0} (#{1}): {2}'.format(game, game.pk, game.message))
+            if options['reset']:
+                Game.objects.filter(pk=game.pk).update(verified_gamelog=game.last_applied_gamelog)
+
+        self.stdout.write('{0} broken game(s)'.format(broken))
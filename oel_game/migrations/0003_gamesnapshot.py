@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 01:20
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oel_game', '0002_auto_20160421_2124'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gamelog_id', models.PositiveIntegerField()),
+                ('version', models.PositiveSmallIntegerField(default=1)),
+                ('state', models.BinaryField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='oel_game.Game')),
+            ],
+            options={
+                'ordering': ['gamelog_id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='seat',
+            name='player',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='gamesnapshot',
+            unique_together=set([('game', 'gamelog_id')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 01:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oel_game', '0003_gamesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='verified_gamelog',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 01:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oel_game', '0004_game_verified_gamelog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamelog',
+            name='structured_command',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 01:49
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_action_players(apps, schema_editor):
+    Game = apps.get_model('oel_game', 'Game')
+    for game in Game.objects.filter(summary_action_seat__isnull=False).select_related('summary_action_seat'):
+        Game.objects.filter(pk=game.pk).update(summary_action_player_id=game.summary_action_seat.player_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('oel_game', '0006_game_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='summary_action_player',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='summary_phase',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(copy_action_players, migrations.RunPython.noop),
+    ]
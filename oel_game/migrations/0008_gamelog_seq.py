@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 01:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def number_gamelogs(apps, schema_editor):
+    Game = apps.get_model('oel_game', 'Game')
+    GameLog = apps.get_model('oel_game', 'GameLog')
+    for game in Game.objects.all():
+        seq = 0
+        for gamelog_id in GameLog.objects.filter(game=game).order_by('id').values_list('id', flat=True):
+            seq += 1
+            GameLog.objects.filter(pk=gamelog_id).update(seq=seq)
+        Game.objects.filter(pk=game.pk).update(seq=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oel_game', '0007_game_summary_action_player'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='gamelog',
+            name='seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(number_gamelogs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Separate from 0008, so that postgres doesn't alter the table in the same transaction that numbered its rows
+
+    dependencies = [
+        ('oel_game', '0008_gamelog_seq'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='gamelog',
+            unique_together=set([('game', 'seq')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 01:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oel_game', '0009_gamelog_seq_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gamelog_count', models.PositiveIntegerField()),
+                ('gamelog', models.BinaryField()),
+                ('version', models.PositiveSmallIntegerField(default=1)),
+                ('state', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='archived',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='gamearchive',
+            name='game',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='oel_game.Game'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 02:01
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oel_game', '0010_gamearchive'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='gamelog',
+            index_together=set([('game', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='seat',
+            index_together=set([('game', 'is_neutral', 'player')]),
+        ),
+    ]
@@ -1,17 +1,28 @@
 from __future__ import unicode_literals
+from collections import OrderedDict
+import copy
+from functools import reduce
 import hashlib
+import json
+import operator
 import random
+import zlib
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models, transaction
+from django.db import models, transaction, IntegrityError
 
 from .commands import Command
+from .deltas import capture_gamestate, diff_gamestate
 from .cards import buildings, settlements
 from .enums import (Age, Phase, Variant, Gameboard, ProductionWheel, ResourceToken, BuildingPlayerCount, LandscapeType,
-                    CardType, PlotSide)
-from .exceptions import UnappliedCommandsError, OeLException, OeLSyntaxError, OeLValueError, InvalidActor
+                    CardType, PlotSide, ReplayMode)
+from .exceptions import UnappliedCommandsError, GameLogConflict, CommandBatchError, GameArchived, OeLException, \
+    OeLSyntaxError, OeLValueError, InvalidActor
 from .landscapes import Heartland, District, Plot
+from .notifications import gamelog_notifier
 from .objects import ModX, GameOptions, GameLedger, LedgerEntry, GameBoard, Prior, LayBrother
+from .snapshots import SNAPSHOT_VERSION, dump_gamestate, load_gamestate
 from .goods import *
 
 
@@ -49,21 +60,132 @@ class GameManager(models.Manager):
         game.build_gamestate()
         return game
 
+    def for_replay(self):
+        """
+        :return: queryset that reads the seats and GameLog entries of all the games at once, for building them
+        """
+        return self.prefetch_related('seat_set__player', 'gamelog_set')
+
+    def in_bulk_for_replay(self, pks):
+        """
+        Reads games along with their seats, GameLog entries and newest snapshots, in a fixed number of queries
+        :return: dict of pk -> Game
+        """
+        games = self.for_replay().in_bulk(pks) if pks else {}
+        snapshots = GameSnapshot.latest_for(list(games))
+        for pk, game in games.items():
+            game._latest_snapshot = snapshots.get(pk)
+        archived = [pk for pk, game in games.items() if game.archived]
+        for archive in GameArchive.objects.filter(game_id__in=archived) if archived else ():
+            games[archive.game_id].gamearchive = archive
+        return games
+
+    def versions(self, pks):
+        """
+        What a built game looks like only changes with its GameLog, apart from players taking seats and the Game row
+        itself being saved, so the newest GameLog id, the number of seats taken and the updated time tell whether a
+        built copy is still current
+        :return: dict of pk -> (newest GameLog id or 0, number of seats taken, updated), read in a single query
+        """
+        subquery = 'SELECT {0} FROM {1} WHERE {1}.game_id = {2}.id'
+        rows = self.filter(pk__in=pks).extra(select={
+            'latest_gamelog': subquery.format('MAX(id)', GameLog._meta.db_table, Game._meta.db_table),
+            'seats_taken': subquery.format('COUNT(player_id)', Seat._meta.db_table, Game._meta.db_table),
+        }).values_list('pk', 'latest_gamelog', 'seats_taken', 'updated')
+        return {pk: (latest_gamelog or 0, seats_taken, updated) for pk, latest_gamelog, seats_taken, updated in rows}
+
+    def awaiting(self, user):
+        """
+        :return: games where it's the user's turn, read from the summary columns
+        """
+        return self.filter(summary_action_player=user).exclude(summary_phase=Phase.Broken)
+
+    def joinable(self, user=None):
+        """
+        :return: games in setup with open player seats, annotated with open_seats, in a single aggregate query.  If user
+            is given, games they already have a seat in are left out.
+        """
+        annotations = {'open_seats': models.Count(models.Case(
+            models.When(seat__is_neutral=False, seat__player__isnull=True, then=1), output_field=models.IntegerField()
+        ))}
+        filters = {'open_seats__gt': 0}
+        if user is not None:
+            annotations['user_seats'] = models.Count(models.Case(
+                models.When(seat__player=user, then=1), output_field=models.IntegerField()
+            ))
+            filters['user_seats'] = 0
+        return self.filter(summary_phase=Phase.Setup).annotate(**annotations).filter(**filters)
+
 
 class Game(models.Model):
     owner = models.ForeignKey(User)
     seed = models.CharField(max_length=50, default=seed_generator, blank=False, null=False, editable=False)
     name = models.CharField(max_length=256, default='New Game', blank=False, null=False)
+    # Set by every save(), so that renames and admin edits show up in versions() like commands and seats do
+    updated = models.DateTimeField(auto_now=True)
+    # Newest GameLog entry that has been applied successfully.  Everything up to it is replayed in trusted mode.
+    verified_gamelog = models.PositiveIntegerField(default=0, editable=False)
+    # Number of GameLog entries appended so far, which is the seq of the newest one.  Appending moves it on with a
+    # conditional UPDATE, so that only one writer gets to append after any given entry.
+    seq = models.PositiveIntegerField(default=0, editable=False)
+    # The GameLog has been packed into a GameArchive, see archive()
+    archived = models.BooleanField(default=False, editable=False)
+
+    # Denormalized copy of the gamestate as of verified_gamelog, written by update_summary() so that listing games
+    # never has to build them
+    summary_variant = models.CharField(max_length=16, blank=True, default='', editable=False)
+    summary_player_count = models.PositiveSmallIntegerField(default=0, editable=False)
+    summary_phase = models.CharField(max_length=32, blank=True, default='', editable=False, db_index=True)
+    summary_round = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+    summary_turn = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+    summary_action_seat = models.ForeignKey('Seat', blank=True, null=True, related_name='+', editable=False,
+                                            on_delete=models.SET_NULL)
+    # The action seat's player, so that finding the games waiting on a user doesn't have to join the seats
+    summary_action_player = models.ForeignKey(User, blank=True, null=True, related_name='+', editable=False,
+                                              on_delete=models.SET_NULL)
 
     objects = GameManager()
 
+    replay_mode = ReplayMode.Trusted
+
+    # Colors of the seats, in seat order
+    seat_colors = ('red', 'green', 'blue', 'white')
+
+    # Everything that build_gamestate() produces.  None of it exists until it's first needed, so that loading a Game
+    # row (in a queryset, or through a ForeignKey) doesn't replay the whole GameLog.
+    _gamestate_attributes = frozenset((
+        'variant', 'options', 'gameboard', 'age', '_phase', '_round', '_round_start_seat_index', '_turn',
+        '_action_seat_index', 'available_buildings', 'available_landscapes', 'work_contract_price', 'ledger',
+        '_gamelog_cursor', '_previous_command', '_last_applied_gamelog', '_gamelogs_since_snapshot', '_message',
+        '_deltas'
+    ))
+
     def __init__(self, *args, **kwargs):
         super(Game, self).__init__(*args, **kwargs)
-        # These are the "Default values".  The actual game values get built/resolved using the build_gamestate() method.
+        self._seats = []
+        self._seat_indexes = None
+        self._gamelogs = None
+        self._gamestate_initialized = False
+
+    def __getattr__(self, name):
+        # Only called when normal attribute lookup fails, which for the gamestate attributes means it isn't built yet
+        if name in Game._gamestate_attributes and not self.__dict__.get('_gamestate_initialized', True):
+            self.load_gamestate()
+            return getattr(self, name)
+        raise AttributeError("'{0}' object has no attribute '{1}'".format(type(self).__name__, name))
+
+    @property
+    def is_gamestate_loaded(self):
+        return self._gamestate_initialized
+
+    def reset_gamestate(self):
+        """
+        Sets the "Default values".  The actual game values get built/resolved using the build_gamestate() method.
+        """
+        self._gamestate_initialized = True
         self.variant = Variant.All
         self.options = GameOptions()
         self.gameboard = GameBoard(Gameboard.FourPlayer, ProductionWheel.Standard)
-        self._seats = []
         self.age = Age.Start
         self._phase = Phase.Setup
         self.round = None
@@ -76,16 +198,26 @@ class Game(models.Model):
                                  Plot(8, 6), Plot(9, 7)]
         }
         self.work_contract_price = Coin(1)
-        self._gamelogs = []
+        self._gamelog_cursor = 0
+        self._previous_command = None
         self._last_applied_gamelog = 0
+        self._gamelogs_since_snapshot = 0
         self._message = ''
+        self._deltas = OrderedDict()
         self.ledger = GameLedger()
+
+    def load_gamestate(self):
+        """
+        Builds the gamestate from scratch.  A command that fails to apply marks the game as Broken instead of raising.
+        """
+        self.reset_gamestate()
         try:
             self.build_gamestate()
         except (OeLException, OeLSyntaxError, OeLValueError) as error:
             print(error)
             self.phase = Phase.Broken
             self._message = '{}: {}'.format(type(error), error)
+            self.update_summary()
 
     @property
     def message(self):
@@ -316,23 +448,51 @@ class Game(models.Model):
 
     @property
     def seats(self):
+        # The seats' goods, landscapes and clergy are part of the gamestate too
+        if not self._gamestate_initialized:
+            self.load_gamestate()
+        if self._seat_indexes is None:
+            self.order_seats()
+        return self._seats
+
+    def order_seats(self):
+        """
+        Sorts the seats by seat_order and indexes them.  Everything else reads the sorted list as it is, so this has to
+        be called whenever a seat_order changes.
+        """
         if not self._seats:
             self._seats = list(self.seat_set.all())
-        self._seats = sorted(self._seats, key=lambda s: (s.seat_order, s.id))
-        return self._seats
+        self._seats.sort(key=lambda s: (s.seat_order, s.id))
+        self._seat_indexes = {s.pk: index for index, s in enumerate(self._seats)}
+        self._seats_by_color = dict(zip(Game.seat_colors, self._seats))
+        self._players = [s for s in self._seats if not s.is_neutral]
+
+    def forget_seats(self):
+        """
+        Drops the seats, so that they're read from the database again the next time they're needed
+        """
+        self._seats = []
+        self._seat_indexes = None
+        getattr(self, '_prefetched_objects_cache', {}).pop('seat_set', None)
+
+    def seat_index(self, pk):
+        """
+        :return: index in seats of the seat with the given pk, or None if it isn't in this game
+        """
+        if self._seat_indexes is None:
+            self.seats
+        return self._seat_indexes.get(pk)
 
     def seat_by_color(self, color):
-        colors = ['red', 'green', 'blue', 'white']
-        if color not in colors:
-            return None
-        index = colors.index(color)
-        if index >= self.number_of_seats:
-            return None
-        return self.seats[index]
+        if self._seat_indexes is None:
+            self.seats
+        return self._seats_by_color.get(color)
 
     @property
     def players(self):
-        return [s for s in self.seats if not s.is_neutral]
+        if self._seat_indexes is None:
+            self.seats
+        return self._players
 
     @property
     def number_of_seats(self):
@@ -344,7 +504,11 @@ class Game(models.Model):
 
     @property
     def can_start(self):
-        return self.phase == Phase.Setup and not [s for s in self.players if not s.player]
+        if self.lobby_phase != Phase.Setup:
+            return False
+        if not self._gamestate_initialized:
+            return not self.seat_set.players().filter(player__isnull=True).exists()
+        return not [s for s in self.players if not s.player]
 
     def start(self):
         if self.phase in (Phase.Settlement, Phase.BonusRound, Phase.FinalAction, Phase.Action, Phase.Endgame,
@@ -355,20 +519,31 @@ class Game(models.Model):
         self.add_commands(('setup finalize', 'setup start', '# Game actions'))
         self.build_gamestate()
 
+    @property
+    def lobby_phase(self):
+        # Until the game gets built, the summary is enough to tell whether it's still in setup
+        if self._gamestate_initialized or not self.summary_phase:
+            return self.phase
+        return self.summary_phase
+
     def can_join(self, player):
-        return self.phase == Phase.Setup and \
-               not [s for s in self.players if s.player == player] and \
-               [s for s in self.players if not s.player]
+        if self.lobby_phase != Phase.Setup:
+            return False
+        if not self._gamestate_initialized:
+            seats = self.seat_set.players()
+            return seats.filter(player__isnull=True).exists() and not seats.filter(player=player).exists()
+        return not [s for s in self.players if s.player == player] and \
+               bool([s for s in self.players if not s.player])
 
     def join(self, player):
-        if self.phase != Phase.Setup or [s for s in self.players if s.player == player]:
+        if self.lobby_phase != Phase.Setup or self.seat_set.players().filter(player=player).exists():
             raise Exception("{0} cannot join this game".format(player))
         open_seat = self.seat_set.players().select_for_update().filter(player__isnull=True).first()
         if not open_seat:
             raise Exception("{0} cannot join this game".format(player))
         open_seat.player = player
         open_seat.save()
-        self._seats = []
+        self.forget_seats()
         return open_seat
 
     @property
@@ -432,10 +607,36 @@ class Game(models.Model):
 
     @property
     def gamelogs(self):
-        if not self._gamelogs:
-            self._gamelogs = list(self.gamelog_set.all())
+        if self._gamelogs is None:
+            if self.archived:
+                self._gamelogs = self.gamearchive.unpack_gamelogs(self)
+            else:
+                self._gamelogs = list(self.gamelog_set.all())
         return self._gamelogs
 
+    def fetch_new_gamelogs(self):
+        """
+        Appends the GameLog entries that have been committed since the newest one this instance knows about.  Only the
+        new rows are read from the database.
+        :return: list of the new GameLog instances
+        """
+        if self._gamelogs is None:
+            # Nothing has been loaded yet, so the full load picks everything up anyway
+            self.gamelogs
+            return []
+        latest_gamelog = self._gamelogs[-1].id if self._gamelogs else self._last_applied_gamelog
+        new_gamelogs = list(self.gamelog_set.filter(id__gt=latest_gamelog))
+        self._gamelogs.extend(new_gamelogs)
+        return new_gamelogs
+
+    def refresh_gamestate(self):
+        """
+        Catches an already built game up with commands that other instances have added, by applying only the new
+        GameLog entries on top of the in-memory state.
+        """
+        self.fetch_new_gamelogs()
+        self.build_gamestate()
+
     def add_command(self, command, executor=None):
         return self.add_commands([command], executor=executor)[-1]
 
@@ -443,39 +644,291 @@ class Game(models.Model):
         """
         Add a command to the game.  This method ensures that the command only gets added if the gamestate is what the
         game thinks it is.  This means that if another instance of this game adds a GameLog entry under its nose,
-        this method will fail
+        this method will fail.  Calling refresh_gamestate() catches up with the new entries before retrying.  The
+        entries aren't applied, so the summary columns (and with them the lobby and awaiting lists) only catch up once
+        the game gets built; submit_commands() does that right away.
         :param commands: iterable sequence of command strings to execute
         :param executor: optional executor that is executing the commands
         :return: GameLog instance created
+        :raises GameLogConflict: if another instance appended entries that this one hasn't applied
+        :raises GameArchived: if the game's GameLog has been archived
         """
-        new_commands = []
-        # Make this process atomic so that things don't get janky
+        if self.archived:
+            raise GameArchived("The game has been archived")
+        commands = list(commands)
+        expected_seq = self.last_applied_seq
         with transaction.atomic():
-            db_latest_gamelog = self.gamelog_set.all().last()
-            if db_latest_gamelog and db_latest_gamelog.id > self._last_applied_gamelog:
-                raise UnappliedCommandsError("There are new unapplied commands")
+            # Claims the seq numbers for the new entries.  If anyone appended since the last applied entry, seq has
+            # moved on and nothing gets written.  The row stays locked until the commit, so concurrent writers queue
+            # up here only for as long as the INSERT takes.
+            if not Game.objects.filter(pk=self.pk, seq=expected_seq, archived=False) \
+                    .update(seq=expected_seq + len(commands)):
+                if Game.objects.filter(pk=self.pk, archived=True).exists():
+                    raise GameArchived("The game has been archived")
+                raise GameLogConflict("There are new unapplied commands")
 
             actor_id = executor.id if executor else None
-            for command in commands:
-                new_commands.append(GameLog.objects.create(game=self, command=command, executor_id=actor_id))
+            # bulk_create() skips save(), so the structured form has to be filled in here
+            GameLog.objects.bulk_create([
+                GameLog(game=self, seq=expected_seq + index + 1, command=command, executor_id=actor_id,
+                        structured_command=GameLog.structure_command(command))
+                for index, command in enumerate(commands)
+            ])
+            # bulk_create() doesn't hand back the new ids, so the rows get read back
+            new_commands = list(self.gamelog_set.filter(seq__gt=expected_seq))
+
+        self.seq = expected_seq + len(commands)
+        self.gamelogs.extend(new_commands)
+        if new_commands:
+            gamelog_notifier.notify(self.pk, new_commands[-1].id)
+        return new_commands
 
-            self.gamelogs.extend(new_commands)
+    @property
+    def last_applied_seq(self):
+        # Every entry the build has walked past has been applied, either directly or through a snapshot
+        return self.gamelogs[self._gamelog_cursor - 1].seq if self._gamelog_cursor else 0
 
-        return new_commands
+    def copy_gamestate(self):
+        """
+        Makes a separate instance of this built game, with its own copy of the gamestate.  Commands can be applied to
+        the copy without changing this game.
+        :return: Game
+        """
+        if self._previous_command and self._previous_command.is_partial:
+            # The partial command holds on to this game's cards, so the copy has to rebuild its own by replaying
+            game = Game.objects.get(pk=self.pk)
+            game.build_gamestate()
+            if game.last_applied_gamelog != self._last_applied_gamelog:
+                raise UnappliedCommandsError("There are new unapplied commands")
+            return game
+
+        game = Game(**{field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields})
+        game._state.adding = self._state.adding
+        game._state.db = self._state.db
+        game._seats = [copy.copy(seat) for seat in self.seats]
+        for seat in game._seats:
+            seat.game = game
+        # Same as after restoring a snapshot, _previous_command is left unset: nothing after a complete command needs it
+        game.reset_gamestate()
+        load_gamestate(game, dump_gamestate(self))
+        game._gamelogs = list(self.gamelogs)
+        game._gamelog_cursor = self._gamelog_cursor
+        game._message = self._message
+        return game
+
+    def check_commands(self, commands, executor=None):
+        """
+        Applies a batch of commands to a copy of the game, to find out whether all of them would succeed.  This game
+        doesn't change.
+        :param commands: iterable sequence of command strings, each one a GameLog entry
+        :param executor: optional executor that is executing the commands
+        :return: the copy of the game, with the commands applied
+        :raises CommandBatchError: for the first command that failed
+        """
+        game = self.copy_gamestate()
+        actor_id = executor.id if executor else None
+        previous_command = game._previous_command
+        for index, command in enumerate(commands):
+            try:
+                previous_command = GameLog(game=game, command=command, executor_id=actor_id).apply(previous_command)
+            except (OeLException, OeLSyntaxError, OeLValueError) as error:
+                raise CommandBatchError(index, error)
+        return game
+
+    def submit_commands(self, commands, executor=None, dry_run=False):
+        """
+        Adds a batch of commands, but only if every one of them applies.  They're checked on a copy of the game first,
+        so nothing gets written when one of them fails, and then added in a single transaction.  They're applied to
+        this game straight after, which writes the summary columns for the new state.
+        :param commands: iterable sequence of command strings, each one a GameLog entry
+        :param executor: optional executor that is executing the commands
+        :param dry_run: only check the commands
+        :return: list of GameLog instances created, which is empty for a dry run
+        :raises CommandBatchError: for the first command that failed
+        """
+        commands = list(commands)
+        self.check_commands(commands, executor=executor)
+        if dry_run:
+            return []
+        gamelogs = self.add_commands(commands, executor=executor)
+        self.build_gamestate()
+        return gamelogs
+
+    @property
+    def snapshot_interval(self):
+        return getattr(settings, 'OEL_SNAPSHOT_INTERVAL', 50)
+
+    def restore_snapshot(self):
+        """
+        Restores the most recent compatible GameSnapshot onto a freshly initialized game, so that only the GameLog
+        entries after it need to be replayed.
+        :return: True if a snapshot was restored
+        """
+        # Verifying means replaying every command, so snapshots are only used in trusted mode
+        if not self.pk or self._last_applied_gamelog or self.replay_mode != ReplayMode.Trusted:
+            return False
+        if '_latest_snapshot' in self.__dict__:
+            # Read along with other games' by GameManager.in_bulk_for_replay()
+            snapshot = self.__dict__.pop('_latest_snapshot')
+        else:
+            snapshot = self.gamesnapshot_set.filter(version=SNAPSHOT_VERSION).last()
+        if not snapshot and self.archived and self.gamearchive.version == SNAPSHOT_VERSION:
+            # The archive keeps the final state in place of the snapshots
+            snapshot = self.gamearchive
+        if not snapshot:
+            return False
+        try:
+            load_gamestate(self, snapshot.state)
+        except ValueError:
+            # Saved before the seats changed, so it has to be replayed from the start
+            return False
+        self._gamelogs_since_snapshot = 0
+        return True
+
+    def save_snapshot(self):
+        """
+        Persists the current gamestate, keyed by the last applied GameLog entry
+        :return: GameSnapshot instance, or None if another process already saved this one
+        """
+        try:
+            with transaction.atomic():
+                snapshot = GameSnapshot.objects.create(game=self, gamelog_id=self._last_applied_gamelog,
+                                                       state=dump_gamestate(self))
+        except IntegrityError:
+            snapshot = None
+        self._gamelogs_since_snapshot = 0
+        return snapshot
 
     def build_gamestate(self):
         """
-        This method applies all of the game's commands to arrive at the current gamestate.
+        This method applies all of the game's commands to arrive at the current gamestate.  If the game hasn't been
+        built yet, the latest snapshot is restored first and only the commands after it are applied.  Entries that
+        have already been walked are never visited again, so repeated calls only cost as much as the new entries.
         :return:
         """
-        previous_command = None
-        for game_command in self.gamelogs:
-            if game_command.id > self._last_applied_gamelog:
-                game_command.apply(previous_command)
-                self._last_applied_gamelog = game_command.id
+        if not self._gamestate_initialized:
+            self.reset_gamestate()
+        # Deltas only get recorded for commands applied on top of an already built game, so that the initial build
+        # doesn't pay for them
+        record_deltas = bool(self._last_applied_gamelog) and self.delta_window > 0
+        self.restore_snapshot()
+
+        gamelogs = self.gamelogs
+        trusted_gamelog = self.verified_gamelog if self.replay_mode == ReplayMode.Trusted else 0
+        gamestate = None
+        try:
+            while self._gamelog_cursor < len(gamelogs):
+                game_command = gamelogs[self._gamelog_cursor]
+                if game_command.id > self._last_applied_gamelog:
+                    if record_deltas and gamestate is None:
+                        gamestate = capture_gamestate(self)
+                    game_command.apply(self._previous_command, trusted=game_command.id <= trusted_gamelog)
+                    self._last_applied_gamelog = game_command.id
+                    self._gamelogs_since_snapshot += 1
+                    if record_deltas:
+                        new_gamestate = capture_gamestate(self)
+                        self.record_delta(game_command.id, diff_gamestate(gamestate, new_gamestate, self.ledger))
+                        gamestate = new_gamestate
+
+                if game_command.parsed_commands:
+                    self._previous_command = game_command.parsed_commands[-1]
+                self._gamelog_cursor += 1
+        finally:
+            self.update_summary()
+
+        # A partial command needs its successor to be resolved, so the state in between can't be snapshotted
+        if self.pk and not self.archived and self._gamelogs_since_snapshot >= self.snapshot_interval and \
+                not (self._previous_command and self._previous_command.is_partial):
+            self.save_snapshot()
+
+    def archive(self):
+        """
+        Packs the GameLog of a finished game into a single GameArchive row, along with the final gamestate, and
+        deletes the individual GameLog entries and snapshots.  The game keeps loading the same way from the archive.
+        :return: GameArchive instance
+        :raises ValueError: if the game hasn't finished
+        :raises GameLogConflict: if another instance appended entries that this one hasn't applied
+        """
+        if self.archived:
+            return self.gamearchive
+        if self.phase != Phase.Endgame:
+            raise ValueError("Only finished games can be archived")
+        gamelogs = self.gamelogs[:self._gamelog_cursor]
+        with transaction.atomic():
+            # Same as appending: the flag only gets set if the log is still where this instance has applied it to
+            if not Game.objects.filter(pk=self.pk, seq=self.last_applied_seq, archived=False).update(archived=True):
+                raise GameLogConflict("There are new unapplied commands")
+            archive = GameArchive.objects.create(game=self, gamelog_count=len(gamelogs),
+                                                 gamelog=GameArchive.pack_gamelogs(gamelogs),
+                                                 state=dump_gamestate(self))
+            self.gamesnapshot_set.all().delete()
+            self.gamelog_set.all().delete()
+        self.archived = True
+        return archive
+
+    @property
+    def delta_window(self):
+        return getattr(settings, 'OEL_DELTA_WINDOW', 50)
 
-            if game_command.parsed_commands:
-                previous_command = game_command.parsed_commands[-1]
+    def record_delta(self, gamelog_id, delta):
+        self._deltas[gamelog_id] = delta
+        while len(self._deltas) > self.delta_window:
+            self._deltas.popitem(last=False)
+
+    def deltas_since(self, gamelog_id):
+        """
+        :param gamelog_id: last GameLog entry the caller has seen applied
+        :return: list of (gamelog id, delta) for every entry applied after gamelog_id, or None if some of them weren't
+            recorded by this instance (the caller then has to fetch the full game instead)
+        """
+        applied = [g.id for g in self.gamelogs if gamelog_id < g.id <= self._last_applied_gamelog]
+        if not all(g in self._deltas for g in applied):
+            return None
+        return [(g, self._deltas[g]) for g in applied]
+
+    def update_summary(self):
+        """
+        Records that every GameLog entry up to the last applied one has passed validation, so that later builds can
+        replay them in trusted mode, along with the summary columns for the resulting gamestate.  Nothing is written if
+        none of it changed.
+        """
+        # Replaying in verify mode passes through older states, which mustn't overwrite the current summary
+        if not self.pk or self._last_applied_gamelog < self.verified_gamelog:
+            return
+        action_seat = self.action_seat
+        summary = {
+            'verified_gamelog': self._last_applied_gamelog,
+            'summary_variant': self.variant,
+            'summary_player_count': self.number_of_players,
+            'summary_phase': self.phase,
+            'summary_round': self.round,
+            'summary_turn': self.turn,
+            'summary_action_player_id': action_seat.player_id if action_seat else None,
+        }
+        if all(getattr(self, name) == value for name, value in summary.items()) and \
+                self.summary_action_seat_id == (action_seat.pk if action_seat else None):
+            return
+        for name, value in summary.items():
+            setattr(self, name, value)
+        self.summary_action_seat_id = action_seat.pk if action_seat else None
+        # Only ever move forwards, even if another process got further in the meantime
+        Game.objects.filter(pk=self.pk, verified_gamelog__lte=self.verified_gamelog).update(
+            summary_action_seat=action_seat, **summary)
+
+    @staticmethod
+    def is_conditional_field(name):
+        """
+        seq, archived, verified_gamelog and the summary columns are only ever written by conditional UPDATEs.  Saving a
+        stale copy of them would stop every append, or bring back the GameLog of an archived game empty.
+        """
+        return name in ('seq', 'archived', 'verified_gamelog') or name.startswith('summary_')
+
+    def save(self, *args, **kwargs):
+        if self.pk and not self._state.adding and not kwargs.get('force_insert') and \
+                kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and not self.is_conditional_field(f.name)]
+        super(Game, self).save(*args, **kwargs)
 
     def __str__(self):
         return 'Game[{}p/{}] {}'.format(self.number_of_players, self.variant[0], self.name if len(self.name) <= 20 else self.name[:17] + '...')
@@ -505,6 +958,8 @@ class SeatManager(models.Manager):
 class Seat(models.Model):
     class Meta:
         ordering = ['id']
+        # Serves finding a game's player seats and its open seat when joining
+        index_together = [('game', 'is_neutral', 'player')]
 
     game = models.ForeignKey(Game)
     player = models.ForeignKey(User, blank=True, null=True)
@@ -849,10 +1304,18 @@ class Seat(models.Model):
 class GameLog(models.Model):
     class Meta:
         ordering = ['id']
+        unique_together = ('game', 'seq')
+        # Reading a game's log, or only its newest entries, comes out of the index already in order
+        index_together = [('game', 'id')]
 
     game = models.ForeignKey(Game)
+    # Position in the game's log, starting at 1.  Taken from Game.seq when the entry is appended.
+    seq = models.PositiveIntegerField(default=0, editable=False)
     executor_id = models.PositiveIntegerField(blank=True, null=True)
     command = models.CharField(max_length=512, blank=True, null=False)
+    # JSON list of Command.structure() for each command in the text.  The text stays the source of truth; this is
+    # empty if the text didn't parse when it was saved.
+    structured_command = models.TextField(blank=True, default='', editable=False)
 
     def __init__(self, *args, **kwargs):
         super(GameLog, self).__init__(*args, **kwargs)
@@ -862,13 +1325,54 @@ class GameLog(models.Model):
     def parsed_commands(self):
         return self._parsed_commands
 
-    def apply(self, previous_command=None):
-        for command_text in self.command.split(';'):
-            if self.executor_id is None and self.game.action_seat is not None:
-                raise InvalidActor('It\'s not your turn')
-            if self.executor_id is not None and self.game.action_seat and self.executor_id != self.game.action_seat.id:
-                raise InvalidActor('It is {}s turn'.format(self.game.action_seat_index))
-            command = Command.command_factory(self.game, self.executor_id, command_text.strip().lower())
+    @staticmethod
+    def structure_command(command):
+        """
+        :return: the structured_command JSON for a command text, or '' if the text doesn't parse
+        """
+        try:
+            structured = [Command.structure(command_text) for command_text in command.split(';')]
+        except (OeLException, OeLSyntaxError, OeLValueError):
+            return ''
+        return json.dumps(structured, separators=(',', ':'), sort_keys=True)
+
+    @property
+    def structured_commands(self):
+        return json.loads(self.structured_command) if self.structured_command else None
+
+    def save(self, *args, **kwargs):
+        # Always derived again, so that editing the text can't leave trusted replays running the old structure
+        self.structured_command = self.structure_command(self.command)
+        if not self.pk and not self.seq:
+            # Appended unconditionally, after whatever is in the log already
+            with transaction.atomic():
+                Game.objects.filter(pk=self.game_id).update(seq=models.F('seq') + 1)
+                self.seq = Game.objects.filter(pk=self.game_id).values_list('seq', flat=True).get()
+                super(GameLog, self).save(*args, **kwargs)
+        else:
+            super(GameLog, self).save(*args, **kwargs)
+        gamelog_notifier.notify(self.game_id, self.id)
+
+    def apply(self, previous_command=None, trusted=False):
+        """
+        Applies the commands in this entry to the game
+        :param previous_command: last command applied before this entry
+        :param trusted: the entry has been applied successfully before, so only the state changes need to be replayed
+        :return: the last command applied
+        """
+        # Trusted entries don't need the grammar checked again, so the structured form is enough to rebuild them
+        if trusted and self.structured_command:
+            parsed_commands = (Command.from_structured(structured) for structured in self.structured_commands)
+        else:
+            parsed_commands = (Command.parse_cached(command_text) for command_text in self.command.split(';'))
+        for command_string, command_class, match in parsed_commands:
+            if not trusted:
+                if self.executor_id is None and self.game.action_seat is not None:
+                    raise InvalidActor('It\'s not your turn')
+                if self.executor_id is not None and self.game.action_seat and \
+                        self.executor_id != self.game.action_seat.id:
+                    raise InvalidActor('It is {}s turn'.format(self.game.action_seat_index))
+            command = command_class(self.game, self.executor_id, command_string, trusted=trusted, match=match)
             command.apply(previous_command=previous_command)
             self.parsed_commands.append(command)
             previous_command = command
@@ -879,3 +1383,73 @@ class GameLog(models.Model):
         if self.executor_id:
             return '({}) {}'.format(self.executor_id, self.command)
         return self.command
+
+
+class GameSnapshot(models.Model):
+    """
+    The serialized gamestate of a Game after applying every GameLog entry up to and including gamelog_id
+    """
+    class Meta:
+        ordering = ['gamelog_id']
+        unique_together = ('game', 'gamelog_id')
+
+    game = models.ForeignKey(Game)
+    gamelog_id = models.PositiveIntegerField()
+    version = models.PositiveSmallIntegerField(default=SNAPSHOT_VERSION)
+    state = models.BinaryField()
+
+    @staticmethod
+    def latest_for(game_ids):
+        """
+        :return: dict of game id -> newest GameSnapshot with the current version, in two queries however many games
+        """
+        if not game_ids:
+            return {}
+        latest = GameSnapshot.objects.filter(game_id__in=game_ids, version=SNAPSHOT_VERSION).order_by() \
+            .values('game_id').annotate(latest=models.Max('gamelog_id'))
+        conditions = [models.Q(game_id=row['game_id'], gamelog_id=row['latest']) for row in latest]
+        if not conditions:
+            return {}
+        return {s.game_id: s for s in GameSnapshot.objects.filter(reduce(operator.or_, conditions))}
+
+    def __str__(self):
+        return 'Snapshot[{}@{}] v{}'.format(self.game_id, self.gamelog_id, self.version)
+
+
+class GameArchive(models.Model):
+    """
+    The whole GameLog of a finished game packed into one row, along with the gamestate after its last entry
+    """
+    game = models.OneToOneField(Game)
+    gamelog_count = models.PositiveIntegerField()
+    # zlib-compressed JSON list with an [id, seq, executor_id, command, structured_command] list per GameLog entry
+    gamelog = models.BinaryField()
+    # Same as GameSnapshot.state
+    version = models.PositiveSmallIntegerField(default=SNAPSHOT_VERSION)
+    state = models.BinaryField()
+
+    @staticmethod
+    def pack_gamelogs(gamelogs):
+        """
+        :return: the GameLog entries as the compressed blob stored in gamelog
+        """
+        rows = [[g.id, g.seq, g.executor_id, g.command, g.structured_command] for g in gamelogs]
+        return zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'), 9)
+
+    def unpack_gamelogs(self, game):
+        """
+        :param game: the Game instance the entries belong to
+        :return: list of GameLog instances, the same as the rows that were archived
+        """
+        gamelogs = []
+        for gamelog_id, seq, executor_id, command, structured_command in \
+                json.loads(zlib.decompress(bytes(self.gamelog)).decode('utf-8')):
+            gamelog = GameLog(id=gamelog_id, game=game, seq=seq, executor_id=executor_id, command=command,
+                              structured_command=structured_command)
+            gamelog._state.adding = False
+            gamelog._state.db = self._state.db
+            gamelogs.append(gamelog)
+        return gamelogs
+
+    def __str__(self):
+        return 'Archive[{}] {} entries v{}'.format(self.game_id, self.gamelog_count, self.version)
@@ -0,0 +1,59 @@
+__author__ = 'Jurek'
+import threading
+import time
+
+from django.conf import settings
+
+
+class GameLogNotifier(object):
+    """
+    Lets requests wait for new GameLog entries of a game.  Entries added by this process wake the waiters right away.
+    Entries added by other processes (several workers sharing the postgres database) are picked up by checking the
+    database again every poll interval, so no message broker is needed.
+    """
+    def __init__(self, poll_interval=None):
+        self._poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._latest = {}
+
+    @property
+    def poll_interval(self):
+        if self._poll_interval is not None:
+            return self._poll_interval
+        return getattr(settings, 'OEL_LONG_POLL_INTERVAL', 1.0)
+
+    def notify(self, game_id, gamelog_id):
+        """
+        Wakes everyone waiting on the game.  Called when GameLog entries get added, which may be before they're
+        committed, so waiters still have to find the entries in the database.
+        """
+        with self._condition:
+            self._latest[game_id] = max(gamelog_id, self._latest.get(game_id, 0))
+            self._condition.notify_all()
+
+    def wait(self, game_id, since, timeout, latest_gamelog):
+        """
+        Blocks until the game has GameLog entries newer than since, or until timeout seconds have passed
+        :param game_id: pk of the game
+        :param since: newest GameLog id the caller knows about
+        :param timeout: seconds to wait at most
+        :param latest_gamelog: callable returning the newest GameLog id of the game in the database
+        :return: True if there are newer entries
+        """
+        deadline = time.time() + timeout
+        while True:
+            with self._condition:
+                notified = self._latest.get(game_id, 0)
+            if (latest_gamelog() or 0) > since:
+                return True
+            remaining = deadline - time.time()
+            # Written this way round so that a NaN timeout can't wait forever
+            if not remaining > 0:
+                return False
+            with self._condition:
+                # Skip the wait if a notification came in while the database was being checked
+                if self._latest.get(game_id, 0) == notified:
+                    self._condition.wait(min(remaining, self.poll_interval))
+
+
+gamelog_notifier = GameLogNotifier()
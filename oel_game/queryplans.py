@@ -0,0 +1,51 @@
+__author__ = 'Jurek'
+from django.db import connections, transaction
+
+
+def explain(queryset):
+    """
+    Asks the database how it would run a queryset, without running it
+    :return: list of the lines of the plan
+    :raises NotImplementedError: for databases other than sqlite and postgres
+    """
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    # select_for_update() querysets need a transaction even just to be explained
+    with transaction.atomic(using=queryset.db), connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        if connection.vendor == 'postgresql':
+            # The planner scans small tables instead of using an index, so it's told not to, to see whether it can
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql, params)
+            return [row[0] for row in cursor.fetchall()]
+    raise NotImplementedError('no query plans for {0}'.format(connection.vendor))
+
+
+def plan_problems(queryset, ordered=False):
+    """
+    :param ordered: the rows have to come out of the index in order, without sorting them afterwards
+    :return: list of the plan lines that read a whole table, or sort the rows if ordered is set
+    """
+    plan = explain(queryset)
+    if connections[queryset.db].vendor == 'sqlite':
+        # Older versions say "SCAN TABLE name"; an index lookup is a SEARCH
+        scans = [line for line in plan if line.startswith('SCAN')]
+        sorts = [line for line in plan if 'TEMP B-TREE' in line]
+    else:
+        scans = [line for line in plan if 'Seq Scan' in line]
+        sorts = [line for line in plan if line.lstrip(' ->').startswith('Sort')]
+    return scans + sorts if ordered else scans
+
+
+def assert_uses_index(queryset, ordered=False):
+    """
+    Fails unless every table the queryset reads is looked up through an index
+    :param ordered: also fail if the rows get sorted after reading them, i.e. the index doesn't cover the ordering
+    :raises AssertionError: with the plan
+    """
+    problems = plan_problems(queryset, ordered=ordered)
+    if problems:
+        raise AssertionError('query does not use an index:\n{0}\n{1}'.format(
+            queryset.query, '\n'.join(explain(queryset))))
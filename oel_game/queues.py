@@ -0,0 +1,201 @@
+__author__ = 'Jurek'
+from collections import deque
+import threading
+
+from django.db import connection
+
+from .cache import game_cache
+from .exceptions import CommandQueueTimeout, GameLogConflict
+
+
+class CommandFuture(object):
+    """
+    Result of a queued batch of commands, which the submitter waits on
+    """
+    def __init__(self, queue=None):
+        self._queue = queue
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the batch to be applied.  A batch that's still queued after timeout seconds is taken off the queue, so
+        that it never gets applied.  One that's already being applied gets waited for until it's done.
+        :return: list of GameLog instances created
+        :raises CommandQueueTimeout: if the batch was taken off the queue without being applied
+        :raises: whatever applying the batch raised
+        """
+        if not self._done.wait(timeout):
+            if self._queue is None or self._queue.cancel(self):
+                raise CommandQueueTimeout('the commands were not applied')
+            self._done.wait()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class GameCommandQueue(object):
+    """
+    Applies the command batches submitted for one game in order, one batch at a time, on the game cache's live
+    instance of the game.  Batches that don't apply fail on their own, without holding up the rest.
+    """
+    def __init__(self, game_id, on_idle=None):
+        """
+        :param on_idle: called with the queue once its worker has run out of batches, instead of stop_if_idle().
+            Returns whether the worker stopped.
+        """
+        self.game_id = game_id
+        self._pending = deque()
+        self._lock = threading.Lock()
+        # Held while applying, so there's never more than one applier per game
+        self._applier = threading.Lock()
+        self._worker = None
+        self._on_idle = on_idle
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, commands, executor_id=None, start_worker=True):
+        """
+        Queues a batch of commands
+        :param commands: iterable sequence of command strings, each one a GameLog entry
+        :param executor_id: pk of the seat executing the commands
+        :param start_worker: apply the batch in a worker thread.  Otherwise it waits for process_pending().
+        :return: CommandFuture
+        """
+        future = CommandFuture(self)
+        with self._lock:
+            self._pending.append((list(commands), executor_id, future))
+            if start_worker and self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='oel-game-{0}'.format(self.game_id))
+                self._worker.daemon = True
+                self._worker.start()
+        return future
+
+    def cancel(self, future):
+        """
+        Takes a batch off the queue, unless it's being applied already
+        :return: True if it was taken off
+        """
+        with self._lock:
+            for entry in self._pending:
+                if entry[2] is future:
+                    self._pending.remove(entry)
+                    return True
+        return False
+
+    def is_idle(self):
+        with self._lock:
+            return not self._pending and self._worker is None
+
+    def stop_if_idle(self):
+        """
+        Lets the worker go, unless a batch came in since it last looked
+        :return: True if the worker stopped
+        """
+        with self._lock:
+            if self._pending:
+                return False
+            self._worker = None
+            return True
+
+    def process_pending(self):
+        """
+        Applies everything that's queued, in the calling thread
+        :return: number of batches processed
+        """
+        count = 0
+        with self._applier:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return count
+                    commands, executor_id, future = self._pending.popleft()
+                self._apply(commands, executor_id, future)
+                count += 1
+
+    def _apply(self, commands, executor_id, future):
+        try:
+            # Requests read the same instance, so it only changes with the game's lock held
+            with game_cache.locked(self.game_id) as game:
+                executor = None
+                if executor_id is not None:
+                    index = game.seat_index(executor_id)
+                    executor = game.seats[index] if index is not None else None
+                try:
+                    gamelogs = game.submit_commands(commands, executor=executor)
+                except GameLogConflict:
+                    # Something wrote to the game without going through the queue
+                    game.refresh_gamestate()
+                    gamelogs = game.submit_commands(commands, executor=executor)
+        except Exception as error:
+            future.set_exception(error)
+        else:
+            future.set_result(gamelogs)
+
+    def _run(self):
+        try:
+            while True:
+                self.process_pending()
+                if self._on_idle(self) if self._on_idle else self.stop_if_idle():
+                    return
+        finally:
+            # The worker's database connection isn't closed by any request
+            connection.close()
+
+
+class CommandQueues(object):
+    """
+    The queues of the games that have batches waiting.  A game's queue is dropped once it has nothing left to do.
+    """
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, game_id):
+        return int(game_id) in self._queues
+
+    def submit(self, game_id, commands, executor_id=None, start_worker=True):
+        game_id = int(game_id)
+        # Submitting under the lock means a queue can't be dropped between being looked up and getting the batch
+        with self._lock:
+            if game_id not in self._queues:
+                self._queues[game_id] = GameCommandQueue(game_id, on_idle=self._worker_idle)
+            return self._queues[game_id].submit(commands, executor_id=executor_id, start_worker=start_worker)
+
+    def _worker_idle(self, queue):
+        with self._lock:
+            if not queue.stop_if_idle():
+                return False
+            if self._queues.get(queue.game_id) is queue:
+                del self._queues[queue.game_id]
+            return True
+
+    def process_pending(self):
+        """
+        Applies everything that's queued for every game, in the calling thread
+        :return: number of batches processed
+        """
+        with self._lock:
+            queues = list(self._queues.values())
+        count = sum(queue.process_pending() for queue in queues)
+        with self._lock:
+            for game_id, queue in list(self._queues.items()):
+                if queue.is_idle():
+                    del self._queues[game_id]
+        return count
+
+
+command_queues = CommandQueues()
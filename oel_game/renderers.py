@@ -0,0 +1,15 @@
+__author__ = 'Jurek'
+from rest_framework.renderers import JSONRenderer
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """
+    Selected with ?format=compact or by accepting its media type.  Games rendered with it use CompactGameSerializer.
+    """
+    media_type = 'application/vnd.oel.compact+json'
+    format = 'compact'
+    # No whitespace, whatever the request's Accept parameters say
+    compact = True
+
+    def get_indent(self, accepted_media_type, renderer_context):
+        return None
@@ -1,11 +1,16 @@
 __author__ = 'Jurek'
+from collections import OrderedDict
+
 from django.contrib.auth.models import User
+from django.utils import six
 from rest_framework import serializers
 
 from .models import Game, Seat, GameLog
+from . import cards
 from .cards.card import Card
-from .cards.building import Building
+from .cards.building import Building, Farmyard, ClayMound, CloisterOffice
 from .commands import Command
+from .enums import LandscapePlot, LandscapeType, ResourceToken
 from .goods import Goods, GoodsSet
 from .landscapes import Landscape, LandscapeColumn
 from .objects import Gameboard, LedgerEntry
@@ -77,9 +82,45 @@ class BuildingSerializer(CardSerializer):
         model = Building
 
 
+# Bump whenever a card's static data or CardSerializer's output changes, so that clients fetch the catalog again
+CARD_CATALOG_VERSION = 1
+_card_catalog = None
+
+
+def card_catalog():
+    """
+    :return: dict of card id -> static card data, for every card in the game
+    """
+    global _card_catalog
+    if _card_catalog is None:
+        card_classes = cards.resources | cards.settlements | cards.buildings | {Farmyard, ClayMound, CloisterOffice}
+        catalog = {}
+        for card_class in card_classes:
+            card = card_class()
+            serializer_class = BuildingSerializer if isinstance(card, Building) else CardSerializer
+            catalog[card.id] = serializer_class(card).data
+        _card_catalog = catalog
+    return _card_catalog
+
+
+class CardReferenceSerializer(serializers.BaseSerializer):
+    """
+    A card in a game only carries its id plus what changes during the game.  Everything else is in the card catalog.
+    """
+    def __init__(self, *args, **kwargs):
+        super(CardReferenceSerializer, self).__init__(*args, read_only=True, **kwargs)
+
+    def to_representation(self, obj):
+        return {
+            'id': obj.id,
+            'assigned_clergy': [{'name': c.name, 'owner': c.owner.pk} for c in getattr(obj, 'assigned_clergy', ())],
+            'can_be_overbuilt': obj.can_be_overbuilt
+        }
+
+
 class LandscapeSpaceSerializer(serializers.Serializer):
     landscape_plot = serializers.CharField(read_only=True)
-    all_cards = CardSerializer(many=True, read_only=True)
+    all_cards = CardReferenceSerializer(many=True)
 
 
 class LandscapeColumnSerializer(serializers.ListSerializer):
@@ -104,6 +145,41 @@ class LandscapeSerializer(serializers.Serializer):
         model = Landscape
 
 
+def _text_or_none(value):
+    return None if value is None else six.text_type(value)
+
+
+def _int_or_none(value):
+    return None if value is None else int(value)
+
+
+def render_landscape(landscape):
+    """
+    Same output as LandscapeSerializer().to_representation(landscape), but built by walking the landscape directly.
+    Every seat's landscapes are in every game response, and going through DRF's fields for each space was most of the
+    cost of serializing a game.
+    """
+    card_reference = CardReferenceSerializer().to_representation
+    return OrderedDict((
+        ('landscape_type', _text_or_none(landscape.landscape_type)),
+        ('horizontal_size', _int_or_none(landscape.horizontal_size)),
+        ('vertical_size', _int_or_none(landscape.vertical_size)),
+        ('row', _int_or_none(landscape.row)),
+        ('column', _int_or_none(landscape.column)),
+        ('landscape_spaces', [
+            [
+                # Mountain Plots are missing their last space
+                OrderedDict((
+                    ('landscape_plot', _text_or_none(space.landscape_plot)),
+                    ('all_cards', [card_reference(card) for card in space.all_cards])
+                )) if space is not None else OrderedDict((('landscape_plot', None), ('all_cards', None)))
+                for space in column
+            ]
+            for column in landscape.landscape_spaces
+        ])
+    ))
+
+
 class LandscapeGridSerializer(serializers.BaseSerializer):
     def __init__(self, *args, **kwargs):
         super(LandscapeGridSerializer, self).__init__(*args, read_only=True, **kwargs)
@@ -112,9 +188,9 @@ class LandscapeGridSerializer(serializers.BaseSerializer):
         return {
             'start': obj['start'],
             'end': obj['end'],
-            'column_0': [LandscapeSerializer().to_representation(l) for l in obj['column_0']],
-            'column_1': [LandscapeSerializer().to_representation(l) for l in obj['column_1']],
-            'column_2': [LandscapeSerializer().to_representation(l) for l in obj['column_2']]
+            'column_0': [render_landscape(l) for l in obj['column_0']],
+            'column_1': [render_landscape(l) for l in obj['column_1']],
+            'column_2': [render_landscape(l) for l in obj['column_2']]
         }
 
 
@@ -143,10 +219,11 @@ class CommandSerializer(serializers.BaseSerializer):
 
 class GameLogSerializer(serializers.ModelSerializer):
     parsed_commands = CommandSerializer(many=True)
+    structured_commands = serializers.ReadOnlyField()
 
     class Meta:
         model = GameLog
-        fields = ('id', 'executor_id', 'command', 'parsed_commands')
+        fields = ('id', 'executor_id', 'command', 'parsed_commands', 'structured_commands')
         depth = 1
 
 
@@ -166,10 +243,19 @@ class LedgerEntrySerializer(serializers.Serializer):
         model = LedgerEntry
 
 
+# Part of the games' ETags, so bump it whenever GameSerializer's output changes
+GAME_SERIALIZER_VERSION = 3
+
+# How many of the newest GameLog and ledger entries are embedded in a game.  The rest is available through the
+# games' gamelogs/ and ledger/ sub-resources.
+RECENT_ENTRIES = 20
+
+
 class GameSerializer(serializers.ModelSerializer):
     #owner = UserSerializer(read_only=True)
     seats = SeatSerializer(many=True, read_only=True)
-    gamelogs = GameLogSerializer(many=True, read_only=True)
+    gamelogs = serializers.SerializerMethodField()
+    gamelog_count = serializers.SerializerMethodField()
 
     variant = serializers.ReadOnlyField()
     options = serializers.ReadOnlyField()
@@ -184,13 +270,191 @@ class GameSerializer(serializers.ModelSerializer):
     #round_start_seat = serializers.ReadOnlyField()
     round_grapes_enter = serializers.ReadOnlyField()
     round_stone_enters = serializers.ReadOnlyField()
-    available_buildings = serializers.ListField(child=BuildingSerializer(), read_only=True)
+    available_buildings = serializers.SerializerMethodField()
+    card_catalog_version = serializers.SerializerMethodField()
     available_landscapes = serializers.DictField(child=serializers.ListField(child=LandscapeSerializer(), read_only=True), read_only=True)
     work_contract_price = GoodsSerializer()
-    ledger = serializers.ListField(child=LedgerEntrySerializer(), read_only=True)
+    ledger = serializers.SerializerMethodField()
+    ledger_start = serializers.SerializerMethodField()
+    ledger_count = serializers.SerializerMethodField()
+
+    def get_available_buildings(self, obj):
+        # Ids only; the rest is in the card catalog
+        return [b.id for b in obj.available_buildings]
+
+    def get_card_catalog_version(self, obj):
+        return CARD_CATALOG_VERSION
+
+    @property
+    def recent_entries(self):
+        return self.context.get('recent_entries', RECENT_ENTRIES)
+
+    def get_gamelogs(self, obj):
+        gamelogs = obj.gamelogs[-self.recent_entries:] if self.recent_entries else []
+        return GameLogSerializer(gamelogs, many=True).data
+
+    def get_gamelog_count(self, obj):
+        return len(obj.gamelogs)
+
+    def get_ledger(self, obj):
+        return LedgerEntrySerializer(obj.ledger[self.get_ledger_start(obj):], many=True).data
+
+    def get_ledger_start(self, obj):
+        # Index of the first embedded ledger entry
+        return max(len(obj.ledger) - self.recent_entries, 0)
+
+    def get_ledger_count(self, obj):
+        return len(obj.ledger)
 
     class Meta:
         model = Game
         depth = 1
         read_only_fields = ('name', )
-        exclude = ('owner', )
\ No newline at end of file
+        # depth = 1 would nest every field of the users behind the foreign keys, so only the seats show players
+        exclude = ('owner', 'summary_variant', 'summary_player_count', 'summary_phase', 'summary_round', 'summary_turn',
+                   'summary_action_seat', 'summary_action_player')
+
+
+# Bump whenever CompactGameSerializer's output changes.  Clients can tell the layouts apart by the 'format' field.
+COMPACT_FORMAT_VERSION = 1
+
+# The compact format replaces names with positions in these tables, which are sent along in 'tables'.  The goods are
+# the ones every seat starts with, followed by the ones the France and Ireland variants add (None when not in play).
+COMPACT_GOODS = ('wood', 'peat', 'grain', 'livestock', 'clay', 'coin', 'stone', 'peat-coal', 'straw', 'meat',
+                 'ceramic', 'book', 'reliquary', 'ornament', 'wonder', 'energy', 'food', 'points', 'money',
+                 'grapes', 'wine', 'flour', 'bread', 'malt', 'beer', 'whiskey')
+COMPACT_TOKENS = (ResourceToken.Wheel, ResourceToken.Wood, ResourceToken.Peat, ResourceToken.Grain,
+                  ResourceToken.Livestock, ResourceToken.Clay, ResourceToken.Coin, ResourceToken.Joker,
+                  ResourceToken.Grapes, ResourceToken.Stone, ResourceToken.House)
+COMPACT_PLOTS = (LandscapePlot.Water, LandscapePlot.Coast, LandscapePlot.Plains, LandscapePlot.Hillside,
+                 LandscapePlot.Mountain, LandscapePlot.ClayMound)
+COMPACT_LANDSCAPES = (LandscapeType.Heartland, LandscapeType.District, LandscapeType.Plot)
+# Leading words of the ledger entries, both the commands and what the game does by itself
+COMPACT_LEDGER_CODES = (
+    'option', 'setup', 'convert', 'buy', 'build', 'pass', 'fell-trees', 'cut-peat', 'place', 'pay', 'use',
+    'starting round', 'return prior', 'return all clergy', 'rotate production wheel', 'remove', 'shift', 'add',
+    'move building marker to round', 'distribute age'
+)
+# Longest first, so that 'return all clergy' isn't taken for something starting with 'return'
+_ledger_prefixes = sorted(enumerate(COMPACT_LEDGER_CODES), key=lambda code: -len(code[1]))
+# Columns of the rows in 'seats', 'landscapes' and 'ledger'
+COMPACT_COLUMNS = {
+    'seats': ('id', 'player', 'is_neutral', 'goods', 'score', 'clergy_pool', 'landscapes'),
+    'landscapes': ('landscape_type', 'row', 'column', 'spaces'),
+    'ledger': ('executor_index', 'code', 'arguments'),
+    'gamelogs': ('id', 'executor_id', 'command')
+}
+
+
+def compact_ledger_entry(entry):
+    """
+    :return: [executor index, index of the leading words in COMPACT_LEDGER_CODES, rest of the text].  Text that
+        doesn't start with any of them gets None for the code.
+    """
+    text = entry.text
+    for code, prefix in _ledger_prefixes:
+        if text == prefix or text.startswith(prefix + ' '):
+            return [entry.executor_index, code, text[len(prefix) + 1:]]
+    return [entry.executor_index, None, text]
+
+
+def compact_space(space):
+    """
+    :return: [plot index, card...] where each card is its id, or [id, [[clergy name, owner seat id], ...]] if it has
+        clergy assigned.  None for the space Mountain Plots are missing.
+    """
+    if space is None:
+        return None
+    cell = [COMPACT_PLOTS.index(space.landscape_plot)]
+    for card in space.all_cards:
+        clergy = getattr(card, 'assigned_clergy', None)
+        cell.append([card.id, [[c.name, c.owner.pk] for c in clergy]] if clergy else card.id)
+    return cell
+
+
+def compact_landscape(landscape):
+    return [COMPACT_LANDSCAPES.index(landscape.landscape_type), landscape.row, landscape.column,
+            [[compact_space(space) for space in column] for column in landscape.landscape_spaces]]
+
+
+class CompactGameSerializer(serializers.BaseSerializer):
+    """
+    The state of a game without the repeated keys: goods and gameboard tokens are integer vectors in a fixed order,
+    landscape spaces are arrays of card ids and ledger entries are code + arguments rows.  Meant for bots and replay
+    viewers fetching the full state often; everything about the cards themselves is in the card catalog.
+    """
+    def __init__(self, *args, **kwargs):
+        super(CompactGameSerializer, self).__init__(*args, read_only=True, **kwargs)
+
+    @property
+    def recent_entries(self):
+        return self.context.get('recent_entries', RECENT_ENTRIES)
+
+    def to_representation(self, obj):
+        ledger_start = max(len(obj.ledger) - self.recent_entries, 0)
+        gamelogs = obj.gamelogs[-self.recent_entries:] if self.recent_entries else []
+        return OrderedDict((
+            ('format', COMPACT_FORMAT_VERSION),
+            ('tables', OrderedDict((
+                ('goods', COMPACT_GOODS),
+                ('tokens', COMPACT_TOKENS),
+                ('plots', COMPACT_PLOTS),
+                ('landscapes', COMPACT_LANDSCAPES),
+                ('ledger_codes', COMPACT_LEDGER_CODES),
+                ('columns', COMPACT_COLUMNS)
+            ))),
+            ('id', obj.pk),
+            ('name', obj.name),
+            ('variant', obj.variant),
+            ('phase', obj.phase),
+            ('message', obj.message),
+            ('age', obj.age),
+            ('round', obj.round),
+            ('turn', obj.turn),
+            ('action_seat_index', obj.action_seat_index),
+            ('last_applied_gamelog', obj.last_applied_gamelog),
+            ('card_catalog_version', CARD_CATALOG_VERSION),
+            ('gameboard', [obj.gameboard.get(token) for token in COMPACT_TOKENS]),
+            ('available_buildings', [b.id for b in obj.available_buildings]),
+            ('available_landscapes', {landscape_type: [[l.id, l.cost.count] for l in landscapes]
+                                      for landscape_type, landscapes in obj.available_landscapes.items()}),
+            ('work_contract_price', [obj.work_contract_price.name, obj.work_contract_price.count]),
+            ('seats', [
+                [s.pk, s.player_id, s.is_neutral,
+                 [s.goods[name].count if name in s.goods else None for name in COMPACT_GOODS], s.score['total'], [c.name for c in s.clergy_pool],
+                 [compact_landscape(l) for l in [s.heartland] + s.landscapes]]
+                for s in obj.seats
+            ]),
+            ('gamelog_count', len(obj.gamelogs)),
+            ('gamelogs', [[g.id, g.executor_id, g.command] for g in gamelogs]),
+            ('ledger_start', ledger_start),
+            ('ledger_count', len(obj.ledger)),
+            ('ledger', [compact_ledger_entry(e) for e in obj.ledger[ledger_start:]])
+        ))
+
+
+class GameSummarySerializer(serializers.ModelSerializer):
+    """
+    Reads only the denormalized summary columns, so serializing a game never builds its gamestate
+    """
+    owner = serializers.ReadOnlyField(source='owner.username')
+    variant = serializers.ReadOnlyField(source='summary_variant')
+    number_of_players = serializers.ReadOnlyField(source='summary_player_count')
+    phase = serializers.ReadOnlyField(source='summary_phase')
+    round = serializers.ReadOnlyField(source='summary_round')
+    turn = serializers.ReadOnlyField(source='summary_turn')
+    action_seat = serializers.ReadOnlyField(source='summary_action_seat_id')
+    action_player = serializers.ReadOnlyField(source='summary_action_seat.player.username')
+    last_applied_gamelog = serializers.ReadOnlyField(source='verified_gamelog')
+
+    class Meta:
+        model = Game
+        fields = ('id', 'name', 'owner', 'variant', 'number_of_players', 'phase', 'round', 'turn', 'action_seat',
+                  'action_player', 'last_applied_gamelog')
+
+
+class LobbyGameSerializer(GameSummarySerializer):
+    open_seats = serializers.ReadOnlyField()
+
+    class Meta(GameSummarySerializer.Meta):
+        fields = ('id', 'name', 'owner', 'variant', 'number_of_players', 'open_seats')
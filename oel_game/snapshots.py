@@ -0,0 +1,110 @@
+__author__ = 'Jurek'
+import io
+import pickle
+import types
+import zlib
+
+try:
+    import copy_reg as copyreg
+except ImportError:
+    import copyreg
+
+# Bump this whenever the set of pickled attributes changes.  Snapshots with a different version are simply ignored
+# and the game falls back to replaying its GameLog.
+SNAPSHOT_VERSION = 1
+
+GAME_STATE_ATTRIBUTES = (
+    'variant', 'options', 'gameboard', 'age', '_phase', '_round', '_round_start_seat_index', '_turn',
+    '_action_seat_index', 'available_buildings', 'available_landscapes', 'work_contract_price', 'ledger',
+    '_last_applied_gamelog'
+)
+SEAT_STATE_ATTRIBUTES = (
+    'seat_order', '_goods', 'heartland', 'clergy_pool', 'landscapes', 'settlements', 'actions_taken',
+    'landscape_purchased_this_turn'
+)
+
+
+def _reduce_method(method):
+    # Python 2 can't pickle bound methods, which some cards use as UseBuilding criteria
+    return getattr, (method.__self__, method.__name__)
+
+
+def _save_method(pickler, method):
+    pickler.save_reduce(*_reduce_method(method), obj=method)
+
+
+class _StatePickler(pickle.Pickler):
+    """
+    The Game and its Seats are database rows, so they're stored as references and re-bound to the live instances when
+    the snapshot is loaded.  Everything else (cards, landscapes, goods, clergy...) gets pickled by value.
+    """
+    def __init__(self, file, game):
+        pickle.Pickler.__init__(self, file, 2)
+        self.game = game
+        self.seats = {id(s): s.pk for s in game.seats}
+        # Only snapshots reduce bound methods like that, rather than every pickle in the process through copyreg.  The
+        # pure Python pickler (Python 2) looks reducers up in dispatch, the C one in dispatch_table.
+        if hasattr(pickle.Pickler, 'dispatch'):
+            self.dispatch = dict(pickle.Pickler.dispatch)
+            self.dispatch[types.MethodType] = _save_method
+        else:
+            self.dispatch_table = copyreg.dispatch_table.copy()
+            self.dispatch_table[types.MethodType] = _reduce_method
+
+    def persistent_id(self, obj):
+        if obj is self.game:
+            return 'game'
+        if id(obj) in self.seats:
+            return 'seat:{0}'.format(self.seats[id(obj)])
+        return None
+
+
+class _StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, game):
+        pickle.Unpickler.__init__(self, file)
+        self.game = game
+        self.seats = {s.pk: s for s in game.seats}
+
+    def persistent_load(self, pid):
+        if pid == 'game':
+            return self.game
+        if pid.startswith('seat:'):
+            if int(pid[5:]) not in self.seats:
+                raise ValueError('snapshot seats do not match the game seats')
+            return self.seats[int(pid[5:])]
+        raise pickle.UnpicklingError('unknown persistent id {0}'.format(pid))
+
+
+def dump_gamestate(game):
+    """
+    Serializes the reconstructed state of a game (and its seats) into a compressed blob
+    :param game: Game to dump
+    :return: bytes
+    """
+    state = {
+        'game': {name: getattr(game, name) for name in GAME_STATE_ATTRIBUTES},
+        'seats': {s.pk: {name: getattr(s, name) for name in SEAT_STATE_ATTRIBUTES} for s in game.seats}
+    }
+    buf = io.BytesIO()
+    _StatePickler(buf, game).dump(state)
+    return zlib.compress(buf.getvalue())
+
+
+def load_gamestate(game, data):
+    """
+    Restores a blob created by dump_gamestate() onto the game and its seats
+    :param game: Game to restore onto.  Its seats must be the same ones that were dumped
+    :param data: bytes
+    :raises ValueError: if the seats aren't the same, in which case the game is left as it was
+    """
+    state = _StateUnpickler(io.BytesIO(zlib.decompress(bytes(data))), game).load()
+    seats = {s.pk: s for s in game.seats}
+    if set(seats) != set(state['seats']):
+        raise ValueError('snapshot seats do not match the game seats')
+    for name, value in state['game'].items():
+        setattr(game, name, value)
+    for pk, seat_state in state['seats'].items():
+        for name, value in seat_state.items():
+            setattr(seats[pk], name, value)
+    # The seat order is part of the state
+    game.order_seats()
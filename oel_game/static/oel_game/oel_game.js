@@ -25,6 +25,8 @@ function showTab(tab) {
     add_class('tab' + tab, 'tabselected');
 }
 
+var cardCatalog = undefined;
+
 angular.module('oelGameApp', ['ngRoute', 'ngResource'])
     .config(function($httpProvider, $interpolateProvider, $routeProvider, $resourceProvider) {
         $httpProvider.defaults.headers.common['X-Requested-With'] = 'XMLHttpRequest';
@@ -74,19 +76,75 @@ angular.module('oelGameApp', ['ngRoute', 'ngResource'])
 
         $scope.loadGames();
     })
-    .controller('ViewGameController', function($scope, $routeParams, $http, $q, $location) {
+    .controller('ViewGameController', function($scope, $routeParams, $http, $q, $location, $timeout) {
         showTab('');
 
         $scope.game = undefined;
         $scope.loadGame = function() {
             $http.get('/game/games/' + $routeParams.gameId + '/').then(function(res) {
-                $scope.game = res.data;
-                showTab('gamepage');
+                var game = res.data;
+                loadCardCatalog(game.card_catalog_version).then(function(catalog) {
+                    // Games only refer to cards by id
+                    game.available_buildings = game.available_buildings.map(function(id) { return catalog.cards[id]; });
+                    $scope.game = game;
+                    showTab('gamepage');
+                    waitForMoves(game.last_applied_gamelog);
+                });
+            });
+        };
+        // Holds a request open on the server until someone makes a move, instead of re-fetching the game to find out
+        var waiting = false;
+        // A dropped connection or a restarting server is retried, waiting twice as long each time up to the maximum
+        var retryDelay = 0;
+        var minRetryDelay = 1000;
+        var maxRetryDelay = 30000;
+        var waitForMoves = function(since) {
+            if (waiting || $scope.$$destroyed) {
+                return;
+            }
+            waiting = true;
+            $http.get('/game/games/' + $routeParams.gameId + '/wait/', {params: {since: since}}).then(function(res) {
+                waiting = false;
+                retryDelay = 0;
+                if (res.data.timed_out) {
+                    waitForMoves(since);
+                } else {
+                    $scope.loadGame();
+                }
+            }, function(res) {
+                waiting = false;
+                // Other client errors, e.g. a deleted game, won't go away by asking again
+                if (res.status > 0 && res.status < 500 && res.status !== 429) {
+                    return;
+                }
+                retryDelay = Math.min(Math.max(retryDelay * 2, minRetryDelay), maxRetryDelay);
+                $timeout(function() {
+                    waitForMoves(since);
+                }, retryDelay);
+            });
+        };
+        // The catalog is static, so it's only fetched again when the game says it's out of date
+        var loadCardCatalog = function(version) {
+            if (cardCatalog && cardCatalog.version === version) {
+                return $q.when(cardCatalog);
+            }
+            return $http.get('/game/cards/').then(function(res) {
+                cardCatalog = res.data;
+                return cardCatalog;
             });
         };
         $scope.loadData = function() {
             $scope.loadGame();
         };
+        // The game only embeds the newest ledger entries, so older ones get fetched a page at a time
+        $scope.loadEarlierLedger = function() {
+            var start = $scope.game.ledger_start;
+            var since = Math.max(0, start - 100);
+            $http.get('/game/games/' + $routeParams.gameId + '/ledger/', {params: {since: since, limit: start - since}}).then(function(res) {
+                $scope.game.ledger = res.data.results.concat($scope.game.ledger);
+                $scope.game.ledger_start = since;
+            });
+        };
 
         this.render_seats = function() {
             console.log("Rendering Seat's canvas");
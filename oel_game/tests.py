@@ -1,14 +1,36 @@
+import json
 import random
+import threading
+import time
+import types
+
+try:
+    import copy_reg as copyreg
+except ImportError:
+    import copyreg
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
 
+from .cache import GameCache, game_cache
 from .cards.building import PeatCoalKiln
-from .enums import Gameboard, Variant, LandscapeType
-from .exceptions import NotEnoughGoods, LandscapeAlreadyPurchased, BuildingPresent, InvalidLandscapePlot, SpaceNotFound
-from .models import Game, Seat, GameLog
+from .commands import _parse_cache, StructuredMatch, Command, Comment, UseBuilding, Continuation, BuildBuilding, \
+    BuildSettlement, Pass, Setup
+from .enums import Gameboard, Variant, LandscapeType, Phase, CardType, ReplayMode
+from .exceptions import NotEnoughGoods, LandscapeAlreadyPurchased, BuildingPresent, InvalidLandscapePlot, SpaceNotFound, \
+    UnappliedCommandsError, GameLogConflict, InvalidOpCode, InvalidArguments, CommandBatchError, \
+    CommandQueueTimeout, GameArchived
+from .models import Game, Seat, GameLog, GameSnapshot, GameArchive
+from .notifications import GameLogNotifier
+from .queues import CommandFuture, CommandQueues, GameCommandQueue
+from .queryplans import assert_uses_index
 from .objects import GameOptions
 from .goods import Coin
+from .management.commands.benchmark_landscape_grid import expanded_seats
+from .serializers import LandscapeSerializer, render_landscape
+from .snapshots import dump_gamestate, load_gamestate
 
 
 # TODO -- Need to make tests for GoodsSet and various Goods comparisons and operations
@@ -33,6 +55,71 @@ def create_and_start_game(player_count, variant, options):
     return game, users
 
 
+def create_and_begin_game(player_count, variant, options):
+    """
+    Same as create_and_start_game(), minus the '# Game actions' comment that start() appends.  Once a seat is active,
+    comments without an executor get rejected, so this is what the replay tests build on.
+    """
+    users = []
+    for i in range(player_count):
+        users.append(create_user(username='user_{0}'.format(i + 1)))
+
+    game = Game.objects.create_game(player_count, variant, options, owner=users[0])
+    for user in users:
+        game.join(user)
+
+    game.add_commands(('setup finalize', 'setup start'))
+    game = Game.objects.get(pk=game.id)
+    return game, users
+
+
+def next_turn(game):
+    """
+    Picks a simple, valid turn for the active seat: use a free heartland building, or clear a Moor or Forest once the
+    clergy are all out.
+    """
+    seat = game.action_seat
+    if game.phase == Phase.Settlement:
+        return 'pass'
+    if seat.clergy_pool:
+        for building_id, arguments in (('h01', 'choose clay'), ('h02', 'choose grain'), ('h03', 'choose coin')):
+            space = seat.find_spaces_matching(lambda s: s.card and s.card.id == building_id).pop()
+            if not space.card.assigned_clergy:
+                return 'place {0} to use {1} to {2}; pass'.format(seat.clergy_pool[0].name, building_id, arguments)
+    for coordinate, card_type, command in (('30c', CardType.Moor, 'cut-peat'), ('31c', CardType.Moor, 'cut-peat'),
+                                           ('30d', CardType.Forest, 'fell-trees'),
+                                           ('31d', CardType.Forest, 'fell-trees'),
+                                           ('30e', CardType.Forest, 'fell-trees')):
+        space = seat.find_space((coordinate[:2], coordinate[2]))
+        if space.card and space.card.card_type == card_type:
+            return '{0} at {1} to choose joker; pass'.format(command, coordinate)
+    return 'pass'
+
+
+def play_turns(game, count):
+    for i in range(count):
+        game.add_command(next_turn(game), executor=game.action_seat)
+        game.build_gamestate()
+
+
+def gamestate_summary(game):
+    return {
+        'phase': game.phase,
+        'age': game.age,
+        'round': game.round,
+        'turn': game.turn,
+        'action_seat_index': game.action_seat_index,
+        'gameboard': dict(game.gameboard),
+        'available_buildings': sorted(b.id for b in game.available_buildings),
+        'ledger': [(e.text, e.executor_index) for e in game.ledger],
+        'seats': [
+            (s.pk, {g.name: g.count for g in s.goods.values()}, sorted(c.name for c in s.clergy_pool),
+             s.score['total'])
+            for s in game.seats
+        ]
+    }
+
+
 class GameMethodTests(TestCase):
     def test_game_creation(self):
         """
@@ -596,3 +683,1229 @@ class GameMethodTests(TestCase):
 
         for seat in game.seats:
             print(seat.pk, seat.player.username, seat.score)
+
+
+class GameSnapshotTests(TestCase):
+    def setUp(self):
+        random.seed('snapshots')
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+
+    @override_settings(OEL_SNAPSHOT_INTERVAL=5)
+    def test_snapshot_saved_every_interval(self):
+        """
+        Building the gamestate should persist a snapshot once enough commands have been applied since the last one
+        """
+        # The four setup commands count towards the first snapshot
+        self.assertEqual(self.game.gamesnapshot_set.count(), 0)
+        play_turns(self.game, 1)
+        self.assertEqual(self.game.gamesnapshot_set.count(), 1)
+        self.assertEqual(self.game.gamesnapshot_set.get().gamelog_id, self.game.last_applied_gamelog)
+        play_turns(self.game, 4)
+        self.assertEqual(self.game.gamesnapshot_set.count(), 1)
+        play_turns(self.game, 1)
+        self.assertEqual(self.game.gamesnapshot_set.count(), 2)
+
+    @override_settings(OEL_SNAPSHOT_INTERVAL=5)
+    def test_snapshot_restore_matches_full_replay(self):
+        """
+        Loading a game from a snapshot and replaying the tail must give exactly the same state as a full replay
+        """
+        play_turns(self.game, 14)
+        self.assertEqual(self.game.gamesnapshot_set.count(), 3)
+
+        restored = Game.objects.get(pk=self.game.pk)
+        restored.build_gamestate()
+        snapshot = self.game.gamesnapshot_set.last()
+        self.assertEqual([g for g in restored.gamelogs if g.parsed_commands][0].id,
+                         [g for g in restored.gamelogs if g.id > snapshot.gamelog_id][0].id)
+
+        GameSnapshot.objects.all().delete()
+        replayed = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(gamestate_summary(restored), gamestate_summary(replayed))
+        self.assertEqual(gamestate_summary(restored), gamestate_summary(self.game))
+
+        # The restored game must keep playing like the original
+        play_turns(restored, 3)
+        GameSnapshot.objects.all().delete()
+        self.assertEqual(gamestate_summary(restored), gamestate_summary(Game.objects.get(pk=self.game.pk)))
+
+    @override_settings(OEL_SNAPSHOT_INTERVAL=5)
+    def test_snapshot_version_mismatch_ignored(self):
+        """
+        Snapshots written by an older state format get skipped in favor of a full replay
+        """
+        play_turns(self.game, 5)
+        GameSnapshot.objects.update(version=0)
+        game = Game.objects.get(pk=self.game.pk)
+        game.build_gamestate()
+        self.assertTrue(all(g.parsed_commands for g in game.gamelogs))
+        self.assertEqual(gamestate_summary(game), gamestate_summary(self.game))
+
+    def test_snapshot_seats_mismatch_ignored(self):
+        """
+        A snapshot whose seats aren't the game's gets skipped in favor of a full replay
+        """
+        owner = create_user(username='other_owner')
+        other = Game.objects.create_game(3, Variant.Ireland, GameOptions(), owner=owner)
+        GameSnapshot.objects.create(game=self.game, gamelog_id=self.game.last_applied_gamelog,
+                                    state=dump_gamestate(other))
+        game = Game.objects.get(pk=self.game.pk)
+        game.build_gamestate()
+        self.assertNotEqual(game.phase, Phase.Broken)
+        self.assertTrue(all(g.parsed_commands for g in game.gamelogs))
+        self.assertEqual(gamestate_summary(game), gamestate_summary(self.game))
+
+    def test_bound_methods_only_in_snapshots(self):
+        """
+        Snapshots pickle bound methods without changing how other pickles in the process do
+        """
+        self.assertNotIn(types.MethodType, copyreg.dispatch_table)
+        restored = Game.objects.get(pk=self.game.pk)
+        restored.reset_gamestate()
+        load_gamestate(restored, dump_gamestate(self.game))
+        self.assertEqual(gamestate_summary(restored), gamestate_summary(self.game))
+
+
+class GameRefreshTests(TestCase):
+    def setUp(self):
+        random.seed('refresh')
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+
+    def test_refresh_applies_only_new_gamelogs(self):
+        """
+        A long-lived game object should catch up with commands added by another instance
+        """
+        other = Game.objects.get(pk=self.game.pk)
+        play_turns(other, 4)
+
+        new_gamelogs = self.game.fetch_new_gamelogs()
+        self.assertEqual([g.id for g in new_gamelogs], [g.id for g in other.gamelogs[-4:]])
+        self.game.build_gamestate()
+        self.assertEqual(gamestate_summary(self.game), gamestate_summary(other))
+
+    def test_refresh_queries(self):
+        """
+        Catching up reads only the new GameLog rows, and doing it again without new rows is a single query
+        """
+        other = Game.objects.get(pk=self.game.pk)
+        play_turns(other, 2)
+        # Reading the new rows, and moving the verified mark past them
+        with self.assertNumQueries(2):
+            self.game.refresh_gamestate()
+        with self.assertNumQueries(1):
+            self.game.refresh_gamestate()
+        self.assertEqual(self.game.last_applied_gamelog, other.last_applied_gamelog)
+
+    def test_refresh_before_adding_commands(self):
+        """
+        After another instance adds a command, refreshing lets this instance add its own
+        """
+        other = Game.objects.get(pk=self.game.pk)
+        play_turns(other, 1)
+        with self.assertRaises(UnappliedCommandsError):
+            self.game.add_command(next_turn(self.game), executor=self.game.action_seat)
+
+        self.game.refresh_gamestate()
+        play_turns(self.game, 1)
+        self.assertEqual(gamestate_summary(self.game), gamestate_summary(Game.objects.get(pk=self.game.pk)))
+
+
+class GameCacheTests(TestCase):
+    def setUp(self):
+        random.seed('cache')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+
+    def test_cache_hit(self):
+        """
+        An unchanged game should come straight out of the cache after a single validation query
+        """
+        game = game_cache.get(self.game.pk)
+        with self.assertNumQueries(1):
+            self.assertIs(game_cache.get(self.game.pk), game)
+        self.assertEqual((game_cache.hits, game_cache.misses), (1, 1))
+
+    def test_cache_replays_tail(self):
+        """
+        When the log has advanced, the cached game should catch up instead of being rebuilt
+        """
+        game = game_cache.get(self.game.pk)
+        play_turns(self.game, 3)
+        self.assertIs(game_cache.get(self.game.pk), game)
+        self.assertEqual(gamestate_summary(game), gamestate_summary(self.game))
+
+    def test_cache_lru_eviction(self):
+        """
+        The least recently used game gets dropped once the cache is full
+        """
+        cache = GameCache(max_size=2)
+        other_games = [Game.objects.create_game(2, Variant.France, GameOptions(), owner=self.users[0])
+                       for i in range(2)]
+        cache.get(self.game.pk)
+        cache.get(other_games[0].pk)
+        cache.get(self.game.pk)
+        cache.get(other_games[1].pk)
+        self.assertEqual(len(cache), 2)
+        self.assertIn(self.game.pk, cache)
+        self.assertNotIn(other_games[0].pk, cache)
+
+    def test_cache_join_evicts(self):
+        """
+        Joining a game doesn't add a command, so it has to drop the cached game explicitly
+        """
+        game = Game.objects.create_game(2, Variant.France, GameOptions(), owner=self.users[0])
+        cached = game_cache.get(game.pk)
+        game.join(self.users[0])
+        self.assertNotIn(game.pk, game_cache)
+        self.assertIsNot(game_cache.get(game.pk), cached)
+
+    def test_cache_seat_taken_elsewhere(self):
+        """
+        A seat taken in another process doesn't send a signal here, so the cache has to notice it on its own
+        """
+        game = Game.objects.create_game(2, Variant.France, GameOptions(), owner=self.users[0])
+        cached = game_cache.get(game.pk)
+        # What the other process's join writes, without this process's post_save receivers seeing it
+        other = Game.objects.get(pk=game.pk)
+        seats = list(other.seat_set.players())
+        for seat, user in zip(seats, self.users):
+            Seat.objects.filter(pk=seat.pk).update(player=user)
+        other.add_commands(('setup finalize', 'setup start'))
+
+        refreshed = game_cache.get(game.pk)
+        self.assertIsNot(refreshed, cached)
+        self.assertEqual(sorted(s.player_id for s in refreshed.seats), sorted(u.pk for u in self.users[:2]))
+        self.assertEqual(refreshed.phase, Phase.Action)
+
+    def test_cache_game_save_evicts(self):
+        """
+        Renaming a game has to drop the cached game too, and the game's lock is held while it's handed out
+        """
+        with game_cache.locked(self.game.pk) as cached:
+            self.assertIs(cached, game_cache.get(self.game.pk))
+            # Other threads can't have it in the meantime
+            acquired = []
+            thread = threading.Thread(target=lambda: acquired.append(game_cache.game_lock(self.game.pk).acquire(False)))
+            thread.start()
+            thread.join()
+            self.assertEqual(acquired, [False])
+        game = Game.objects.get(pk=self.game.pk)
+        game.name = 'Renamed'
+        game.save()
+        self.assertNotIn(self.game.pk, game_cache)
+        self.assertEqual(game_cache.get(self.game.pk).name, 'Renamed')
+
+    def test_cache_detail_view(self):
+        """
+        The REST detail endpoint should be served from the cache
+        """
+        response = self.client.get('/game/games/{0}/'.format(self.game.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['last_applied_gamelog'], self.game.last_applied_gamelog)
+        self.assertIn(self.game.pk, game_cache)
+
+
+class GameLazyLoadTests(TestCase):
+    def setUp(self):
+        random.seed('lazy')
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+
+    def test_queryset_load_does_not_replay(self):
+        """
+        Loading games through a queryset or a ForeignKey should be a plain row fetch
+        """
+        with self.assertNumQueries(1):
+            games = list(Game.objects.filter().order_by('-id')[:5])
+        self.assertFalse(games[0].is_gamestate_loaded)
+
+        gamelog = GameLog.objects.filter(game=self.game).last()
+        with self.assertNumQueries(1):
+            self.assertEqual(gamelog.game.name, self.game.name)
+        self.assertFalse(gamelog.game.is_gamestate_loaded)
+
+    def test_gamestate_built_on_first_access(self):
+        """
+        The first access to a piece of the gamestate builds it
+        """
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.phase, Phase.Action)
+        self.assertTrue(game.is_gamestate_loaded)
+        self.assertEqual(game.last_applied_gamelog, self.game.gamelogs[-1].id)
+
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.seats[0].goods['clay'], 1)
+        self.assertTrue(game.is_gamestate_loaded)
+
+    def test_commands_added_to_unloaded_game(self):
+        """
+        Adding a command must not mistake the unloaded game for one that's missing commands
+        """
+        command, executor = next_turn(self.game), self.game.action_seat
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertFalse(game.is_gamestate_loaded)
+        game.add_command(command, executor=executor)
+        game.build_gamestate()
+        self.assertEqual(game.last_applied_gamelog, game.gamelogs[-1].id)
+
+
+class GameReplayModeTests(TestCase):
+    def setUp(self):
+        random.seed('replay')
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+        play_turns(self.game, 12)
+
+    def test_verified_gamelog_advances(self):
+        """
+        Every successfully applied GameLog entry is recorded as verified
+        """
+        self.assertEqual(self.game.verified_gamelog, self.game.last_applied_gamelog)
+        self.assertEqual(Game.objects.get(pk=self.game.pk).verified_gamelog, self.game.last_applied_gamelog)
+
+    def test_trusted_replay_matches_verified_replay(self):
+        """
+        Replaying only the state changes has to end up in exactly the same gamestate as validating everything
+        """
+        trusted = Game.objects.get(pk=self.game.pk)
+        verified = Game.objects.get(pk=self.game.pk)
+        verified.replay_mode = ReplayMode.Verify
+        self.assertEqual(gamestate_summary(trusted), gamestate_summary(verified))
+        self.assertEqual(gamestate_summary(trusted), gamestate_summary(self.game))
+        self.assertTrue(all(c.trusted for g in trusted.gamelogs for c in g.parsed_commands))
+        self.assertFalse(any(c.trusted for g in verified.gamelogs for c in g.parsed_commands))
+
+    def test_unverified_gamelogs_validated(self):
+        """
+        Entries past the verified mark still get validated in trusted mode
+        """
+        seat = self.game.seats[(self.game.action_seat_index + 1) % 3]
+        self.game.add_command('pass', executor=seat)
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.phase, Phase.Broken)
+        self.assertEqual(game.verified_gamelog, self.game.last_applied_gamelog)
+
+    def test_verify_mode_catches_invalid_gamelog(self):
+        """
+        Verifying re-validates the entries below the verified mark, which trusted commands don't
+        """
+        with self.assertRaises(InvalidOpCode):
+            Command.command_factory(self.game, None, 'pass').validate()
+        Command.command_factory(self.game, None, 'pass', trusted=True).validate()
+
+        gamelog = GameLog.objects.filter(game=self.game, executor_id__isnull=False).first()
+        seat_ids = [s.pk for s in self.game.seats]
+        GameLog.objects.filter(pk=gamelog.pk).update(
+            executor_id=seat_ids[(seat_ids.index(gamelog.executor_id) + 1) % len(seat_ids)])
+
+        game = Game.objects.get(pk=self.game.pk)
+        game.replay_mode = ReplayMode.Verify
+        self.assertEqual(game.phase, Phase.Broken)
+        self.assertEqual(game.last_applied_gamelog, gamelog.pk - 1)
+
+
+class CommandParseTests(TestCase):
+    def test_parse_by_verb(self):
+        """
+        Command strings are dispatched on their leading verb, and the returned match is the class' own
+        """
+        for command_string, command_class in (('# game actions', Comment), ('//note', Comment),
+                                              ('place prior to use h01 to choose clay', UseBuilding),
+                                              ('pay 1 coin to red to use g01', UseBuilding),
+                                              ('use g01 to choose wood', Continuation),
+                                              ('build g02 at 31c', BuildBuilding),
+                                              ('build s01 at 32c with 1 wood', BuildSettlement),
+                                              ('pass', Pass)):
+            parsed_class, match = Command.parse(command_string)
+            self.assertIs(parsed_class, command_class)
+            self.assertEqual(match.re, command_class.match_regex)
+
+    def test_parse_cached(self):
+        """
+        Replaying a game remembers the parsed form of every command text it has seen
+        """
+        _parse_cache.clear()
+        random.seed('parse')
+        game, users = create_and_begin_game(2, Variant.France, GameOptions())
+        game.build_gamestate()
+        self.assertIn('setup start', _parse_cache)
+        parsed = Command.parse_cached('Setup Start ')
+        self.assertEqual(parsed[:2], ('setup start', Setup))
+        self.assertIs(Command.parse_cached('Setup Start '), parsed)
+
+        # Trusted replays use the structured form instead, so verify to make the text get parsed
+        game = Game.objects.get(pk=game.pk)
+        game.replay_mode = ReplayMode.Verify
+        game.build_gamestate()
+        self.assertIs(game.gamelogs[-1].parsed_commands[0].match, _parse_cache['setup start'][2])
+
+    def test_parse_invalid(self):
+        """
+        Unknown verbs and strings that don't fit their verb's grammar are rejected
+        """
+        for command_string in ('', 'dance', 'build x01 at 31c', 'pass now', 'passing'):
+            with self.assertRaises(InvalidArguments):
+                Command.parse(command_string)
+
+
+class GameLogStructuredCommandTests(TestCase):
+    def setUp(self):
+        random.seed('structured')
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+        play_turns(self.game, 6)
+
+    def test_structured_on_save(self):
+        """
+        Committed commands get their structured form saved next to the text
+        """
+        gamelog = GameLog.objects.filter(game=self.game, command__startswith='place').first()
+        structured = gamelog.structured_commands
+        self.assertEqual([s['verb'] for s in structured], ['place', 'pass'])
+        self.assertEqual(structured[0]['type'], 'UseBuilding')
+        self.assertEqual(structured[0]['arguments']['building_id'], 'h01')
+        self.assertEqual(structured[0]['arguments']['clergy'], 'prior')
+        self.assertEqual(structured[0]['arguments']['arguments'], 'choose clay')
+
+        command_string, command_class, match = Command.from_structured(structured[0])
+        self.assertIs(command_class, UseBuilding)
+        self.assertIsInstance(match, StructuredMatch)
+        self.assertIsNone(match.group('payment_amount'))
+
+        self.assertEqual(GameLog.structure_command('dance'), '')
+
+        # Edited text gets structured again, and text that doesn't parse anymore drops the old structure
+        gamelog.command = 'place prior to use h01 to choose wood; pass'
+        gamelog.save()
+        self.assertEqual(gamelog.structured_commands[0]['arguments']['arguments'], 'choose wood')
+        gamelog.command = 'dance'
+        gamelog.save()
+        self.assertIsNone(GameLog.objects.get(pk=gamelog.pk).structured_commands)
+
+    def test_trusted_replay_from_structured(self):
+        """
+        Replaying from the structured form gives the same state as parsing the text
+        """
+        game = Game.objects.get(pk=self.game.pk)
+        game.build_gamestate()
+        self.assertTrue(all(isinstance(c.match, StructuredMatch) for g in game.gamelogs for c in g.parsed_commands))
+        self.assertEqual(gamestate_summary(game), gamestate_summary(self.game))
+
+    def test_backfill(self):
+        """
+        The backfill command fills in entries saved before the structured column existed
+        """
+        expected = dict(GameLog.objects.values_list('id', 'structured_command'))
+        GameLog.objects.update(structured_command='')
+        call_command('backfill_structured_commands', batch_size=4, stdout=StringIO())
+        self.assertEqual(dict(GameLog.objects.values_list('id', 'structured_command')), expected)
+
+
+class GameDeltaTests(TestCase):
+    def setUp(self):
+        random.seed('deltas')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+
+    def test_deltas_recorded(self):
+        """
+        Applying a command on top of a built game records what it changed
+        """
+        seat = self.game.action_seat
+        self.game.add_command('place prior to use h01 to choose clay; pass', executor=seat)
+        self.game.build_gamestate()
+
+        (gamelog_id, delta), = self.game.deltas_since(self.game.gamelogs[-2].id)
+        self.assertEqual(gamelog_id, self.game.last_applied_gamelog)
+        self.assertEqual(delta['seats'][seat.pk]['goods'], {'clay': seat.goods['clay'].count})
+        self.assertEqual(delta['seats'][seat.pk]['clergy_pool'], ['lay-brother', 'lay-brother'])
+        self.assertEqual(list(delta['seats'][seat.pk]['spaces'].values()),
+                         [{'cards': ['h01'], 'clergy': [[seat.pk, 'prior']]}])
+        self.assertEqual(delta['status'], {'action_seat_index': self.game.action_seat_index, 'turn': self.game.turn})
+        self.assertEqual([e['text'] for e in delta['ledger']], ['place prior to use h01 to choose clay', 'pass'])
+        # Producing clay moves its token to the wheel
+        self.assertEqual(delta['gameboard'], {'clay': self.game.gameboard['clay']})
+
+    def test_deltas_unknown(self):
+        """
+        A freshly built game can't tell what happened before it was built
+        """
+        play_turns(self.game, 2)
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertIsNone(game.deltas_since(self.game.gamelogs[-3].id))
+        self.assertEqual(game.deltas_since(game.last_applied_gamelog), [])
+        self.assertEqual(len(self.game.deltas_since(self.game.gamelogs[-3].id)), 2)
+
+    @override_settings(OEL_DELTA_WINDOW=3)
+    def test_delta_window(self):
+        """
+        Only the most recent deltas are kept
+        """
+        since = self.game.last_applied_gamelog
+        play_turns(self.game, 4)
+        self.assertIsNone(self.game.deltas_since(since))
+        self.assertEqual(len(self.game.deltas_since(self.game.gamelogs[-4].id)), 3)
+
+    def test_deltas_endpoint(self):
+        """
+        Clients polling the deltas endpoint get the changes since their last known entry
+        """
+        url = '/game/games/{0}/deltas/'.format(self.game.pk)
+        since = self.game.last_applied_gamelog
+        response = self.client.get(url, {'since': since})
+        self.assertEqual(response.data['deltas'], [])
+        self.assertFalse(response.data['reset'])
+
+        play_turns(self.game, 2)
+        response = self.client.get(url, {'since': since})
+        self.assertFalse(response.data['reset'])
+        self.assertEqual([d['gamelog_id'] for d in response.data['deltas']], [g.id for g in self.game.gamelogs[-2:]])
+        self.assertEqual(response.data['last_applied_gamelog'], self.game.last_applied_gamelog)
+        full_response = self.client.get('/game/games/{0}/'.format(self.game.pk))
+        self.assertLess(len(response.content) * 10, len(full_response.content))
+
+        self.assertTrue(self.client.get(url, {'since': 0}).data['reset'])
+        self.assertEqual(self.client.get(url, {'since': 'x'}).status_code, 400)
+
+
+class GameAddCommandsTests(TestCase):
+    def setUp(self):
+        random.seed('add_commands')
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+
+    def test_add_commands_bulk(self):
+        """
+        A batch of commands is written with a single INSERT, no matter how many commands it has
+        """
+        commands = ['# comment {0}'.format(i) for i in range(5)]
+        # Savepoint, conditional seq UPDATE, INSERT, reading the new rows back, savepoint release
+        with self.assertNumQueries(5):
+            new_commands = self.game.add_commands(commands)
+        self.assertEqual([g.command for g in new_commands], commands)
+        self.assertEqual(self.game.gamelogs[-5:], new_commands)
+        self.assertEqual(list(GameLog.objects.filter(game=self.game).order_by('-id')[:5])[::-1], new_commands)
+        self.assertEqual(new_commands[0].structured_commands[0]['type'], 'Comment')
+
+    def test_add_commands_unapplied(self):
+        """
+        Nothing is written when another instance has added commands that this one hasn't applied
+        """
+        other = Game.objects.get(pk=self.game.pk)
+        play_turns(other, 1)
+        count = GameLog.objects.count()
+        with self.assertRaises(UnappliedCommandsError):
+            self.game.add_commands(['pass'], executor=self.game.action_seat)
+        self.assertEqual(GameLog.objects.count(), count)
+
+    def test_add_commands_seq(self):
+        """
+        Every entry gets the next seq, and a writer that lost the race can catch up and try again
+        """
+        other = Game.objects.get(pk=self.game.pk)
+        other.build_gamestate()
+        play_turns(other, 1)
+        command = next_turn(self.game)
+        with self.assertRaises(GameLogConflict):
+            self.game.add_command(command, executor=self.game.action_seat)
+
+        self.game.refresh_gamestate()
+        self.game.add_commands(['# retried', next_turn(self.game)], executor=self.game.action_seat)
+        seqs = list(GameLog.objects.filter(game=self.game).values_list('seq', flat=True))
+        self.assertEqual(seqs, list(range(1, len(seqs) + 1)))
+        self.assertEqual(Game.objects.get(pk=self.game.pk).seq, len(seqs))
+        self.assertEqual(self.game.seq, len(seqs))
+
+        # A stale instance saving its other fields leaves seq alone
+        other.name = 'Renamed'
+        other.save()
+        self.assertEqual(Game.objects.get(pk=self.game.pk).seq, len(seqs))
+        self.assertEqual(GameLog.objects.create(game=self.game, command='# appended').seq, len(seqs) + 1)
+
+
+class GameSummaryTests(TestCase):
+    def setUp(self):
+        random.seed('summary')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+        play_turns(self.game, 4)
+
+    def test_summary_columns(self):
+        """
+        Building a game keeps its summary columns in line with the gamestate
+        """
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual((game.summary_variant, game.summary_player_count, game.summary_phase, game.summary_round,
+                          game.summary_turn, game.summary_action_seat_id, game.verified_gamelog),
+                         (Variant.Ireland, 3, self.game.phase, self.game.round, self.game.turn,
+                          self.game.action_seat.pk, self.game.last_applied_gamelog))
+        self.assertFalse(game.is_gamestate_loaded)
+
+    def test_summary_on_commit(self):
+        """
+        Submitted commands write the summary when they're committed; plain appends leave it until the next build
+        """
+        seat = self.game.action_seat
+        self.game.add_command(next_turn(self.game), executor=seat)
+        self.assertEqual(Game.objects.get(pk=self.game.pk).summary_action_player_id, seat.player_id)
+        self.game.build_gamestate()
+        self.assertNotEqual(Game.objects.get(pk=self.game.pk).summary_action_player_id, seat.player_id)
+
+        seat = self.game.action_seat
+        gamelogs = self.game.submit_commands([next_turn(self.game)], executor=seat)
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.verified_gamelog, gamelogs[-1].id)
+        self.assertEqual(game.summary_action_seat_id, self.game.action_seat.pk)
+        self.assertNotEqual(game.summary_action_seat_id, seat.pk)
+
+    def test_summary_broken(self):
+        """
+        A game that fails to build is listed as broken
+        """
+        self.game.add_command('pass', executor=self.game.seats[(self.game.action_seat_index + 1) % 3])
+        Game.objects.get(pk=self.game.pk).load_gamestate()
+        self.assertEqual(Game.objects.get(pk=self.game.pk).summary_phase, Phase.Broken)
+
+    def test_list_never_builds(self):
+        """
+        Listing games is a single query however many games there are and however long they are
+        """
+        for i in range(3):
+            Game.objects.create_game(2, Variant.France, GameOptions(), owner=self.users[0])
+        with self.assertNumQueries(1):
+            response = self.client.get('/game/games/')
+        self.assertEqual(len(response.data), 4)
+        summary = [g for g in response.data if g['id'] == self.game.pk][0]
+        self.assertEqual(summary['phase'], self.game.phase)
+        self.assertEqual(summary['action_player'], self.game.action_seat.player.username)
+        self.assertEqual(summary['last_applied_gamelog'], self.game.last_applied_gamelog)
+        self.assertNotIn(self.game.pk, game_cache)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.client.get('/game/games/latest/').data), 4)
+
+    def test_detail_hides_users(self):
+        """
+        The detail response only ever shows users through UserSerializer, never their account fields
+        """
+        def keys(data):
+            if isinstance(data, dict):
+                return set(data) | set(k for value in data.values() for k in keys(value))
+            if isinstance(data, list):
+                return set(k for value in data for k in keys(value))
+            return set()
+
+        data = json.loads(self.client.get('/game/games/{0}/'.format(self.game.pk)).content.decode('utf-8'))
+        self.assertIsNotNone(Game.objects.get(pk=self.game.pk).summary_action_player_id)
+        self.assertFalse(keys(data) & {'password', 'email', 'is_superuser', 'is_staff', 'last_login'})
+
+    def test_awaiting(self):
+        """
+        The games waiting on a player are found from the summary columns alone
+        """
+        Game.objects.create_game(2, Variant.France, GameOptions(), owner=self.users[0])
+        player = self.game.action_seat.player
+        self.assertEqual(Game.objects.get(pk=self.game.pk).summary_action_player_id, player.pk)
+        self.assertEqual(list(Game.objects.awaiting(player)), [self.game])
+        others = [u for u in self.users if u != player]
+        self.assertEqual(list(Game.objects.awaiting(others[0])), [])
+
+        self.assertEqual(self.client.get('/game/games/', {'awaiting': 'me'}).data, [])
+        self.client.force_login(player)
+        self.assertEqual([g['id'] for g in self.client.get('/game/games/', {'awaiting': 'me'}).data], [self.game.pk])
+        self.client.force_login(others[0])
+        self.assertEqual(self.client.get('/game/games/', {'awaiting': 'me'}).data, [])
+        self.assertEqual(self.client.get('/game/games/', {'awaiting': 'you'}).status_code, 400)
+
+
+class GameETagTests(TestCase):
+    def setUp(self):
+        random.seed('etag')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+        self.url = '/game/games/{0}/'.format(self.game.pk)
+
+    def test_not_modified(self):
+        """
+        Polling an unchanged game answers 304 from a single query, without building the game
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        game_cache.clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn(self.game.pk, game_cache)
+
+    def test_etag_changes(self):
+        """
+        New commands and players taking seats both change the ETag
+        """
+        etag = self.client.get(self.url)['ETag']
+        play_turns(self.game, 1)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        game = Game.objects.create_game(2, Variant.France, GameOptions(), owner=self.users[0])
+        url = '/game/games/{0}/'.format(game.pk)
+        etag = self.client.get(url)['ETag']
+        game.join(self.users[0])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_changes_on_save(self):
+        """
+        Editing the Game row, e.g. renaming it, changes the ETag and isn't hidden by the cached game
+        """
+        etag = self.client.get(self.url)['ETag']
+        other = Game.objects.get(pk=self.game.pk)
+        other.name = 'Renamed'
+        other.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['name'], 'Renamed')
+
+    def test_representations(self):
+        """
+        The JSON and the browsable API share the URL, so they get different ETags and the response varies on Accept
+        """
+        response = self.client.get(self.url)
+        self.assertIn('Accept', response['Vary'])
+        html = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertNotEqual(html['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(self.url, {'format': 'api'})['ETag'], html['ETag'])
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=response['ETag'])
+                         .status_code, 200)
+
+    def test_missing_game(self):
+        """
+        Games that don't exist have no ETag and still get a 404
+        """
+        self.assertEqual(self.client.get('/game/games/0/').status_code, 404)
+        self.assertEqual(self.client.get('/game/{0}/'.format(self.game.pk)).status_code, 200)
+
+
+class GameEntryWindowTests(TestCase):
+    def setUp(self):
+        random.seed('windows')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+        play_turns(self.game, 25)
+        self.url = '/game/games/{0}/'.format(self.game.pk)
+
+    def test_recent_entries_embedded(self):
+        """
+        The game payload only embeds the newest GameLog and ledger entries
+        """
+        data = self.client.get(self.url).data
+        self.assertEqual([g['id'] for g in data['gamelogs']], [g.id for g in self.game.gamelogs[-20:]])
+        self.assertEqual(data['gamelog_count'], len(self.game.gamelogs))
+        self.assertEqual([e['text'] for e in data['ledger']], [e.text for e in self.game.ledger[-20:]])
+        self.assertEqual(data['ledger_start'], len(self.game.ledger) - 20)
+        self.assertEqual(data['ledger_count'], len(self.game.ledger))
+
+    def test_gamelogs_pages(self):
+        """
+        Following next_since through the gamelogs sub-resource visits every entry once
+        """
+        ids, since = [], 0
+        while since is not None:
+            data = self.client.get(self.url + 'gamelogs/', {'since': since, 'limit': 7}).data
+            self.assertLessEqual(len(data['results']), 7)
+            ids.extend(g['id'] for g in data['results'])
+            since = data['next_since']
+        self.assertEqual(ids, [g.id for g in self.game.gamelogs])
+
+    def test_ledger_pages(self):
+        """
+        Following next_since through the ledger sub-resource visits every entry once
+        """
+        texts, since = [], 0
+        while since is not None:
+            data = self.client.get(self.url + 'ledger/', {'since': since, 'limit': 9}).data
+            self.assertEqual(data['start'], since)
+            texts.extend(e['text'] for e in data['results'])
+            since = data['next_since']
+        self.assertEqual(texts, [e.text for e in self.game.ledger])
+        self.assertEqual(self.client.get(self.url + 'ledger/', {'limit': -1}).status_code, 400)
+        self.assertEqual(self.client.get(self.url + 'ledger/', {'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get(self.url + 'gamelogs/', {'limit': 0}).status_code, 400)
+
+
+class CardCatalogTests(TestCase):
+    def setUp(self):
+        random.seed('catalog')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+        play_turns(self.game, 3)
+
+    def test_catalog(self):
+        """
+        The catalog has the static data of every card, and can be cached by the client
+        """
+        response = self.client.get('/game/cards/')
+        self.assertEqual(response.status_code, 200)
+        catalog = response.data['cards']
+        self.assertEqual(catalog['h01']['name'], 'Clay Mound')
+        self.assertTrue(all(b.id in catalog for b in self.game.available_buildings))
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(self.client.get('/game/cards/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_game_refers_to_cards_by_id(self):
+        """
+        Game payloads carry card ids plus the dynamic state of each card
+        """
+        data = self.client.get('/game/games/{0}/'.format(self.game.pk)).data
+        self.assertEqual(data['available_buildings'], [b.id for b in self.game.available_buildings])
+        self.assertEqual(data['card_catalog_version'], self.client.get('/game/cards/').data['version'])
+
+        seat = self.game.seats[0]
+        space = seat.find_spaces_matching(lambda s: s.card and getattr(s.card, 'assigned_clergy', None)).pop()
+        spaces = [s for landscape in data['seats'][0]['landscape_grid']['column_1']
+                  for column in landscape['landscape_spaces'] for s in column]
+        cards = [c for s in spaces for c in s['all_cards'] if c['id'] == space.card.id]
+        self.assertEqual(cards, [{'id': space.card.id, 'can_be_overbuilt': False,
+                                  'assigned_clergy': [{'name': 'prior', 'owner': seat.pk}]}])
+
+
+class LandscapeGridRendererTests(TestCase):
+    def test_matches_landscape_serializer(self):
+        """
+        The hand-rolled renderer gives the same output as the nested serializers, including the missing Mountain space
+        """
+        seat = expanded_seats(1)[0]
+        landscapes = [seat.heartland] + seat.landscapes
+        self.assertEqual(len(set((l.landscape_type, getattr(l, 'landscape_side', None)) for l in landscapes)), 5)
+        for landscape in landscapes:
+            self.assertEqual(render_landscape(landscape), LandscapeSerializer().to_representation(landscape))
+
+        mountain = [l for l in landscapes if None in l.landscape_spaces[1]][0]
+        self.assertEqual(render_landscape(mountain)['landscape_spaces'][1][1],
+                         {'landscape_plot': None, 'all_cards': None})
+
+
+class GameLogWaitTests(TestCase):
+    def setUp(self):
+        random.seed('wait')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+
+    def test_new_entries(self):
+        """
+        Waiting returns right away with the entries and deltas the client hasn't seen
+        """
+        since = game_cache.get(self.game.pk).last_applied_gamelog
+        self.game.add_command('place prior to use h01 to choose clay; pass', executor=self.game.action_seat)
+
+        data = self.client.get('/game/games/{0}/wait/'.format(self.game.pk), {'since': since, 'timeout': 5}).data
+        self.assertFalse(data['timed_out'])
+        self.assertFalse(data['reset'])
+        self.assertEqual([g['command'] for g in data['gamelogs']], ['place prior to use h01 to choose clay; pass'])
+        self.assertEqual([d['gamelog_id'] for d in data['deltas']], [data['gamelogs'][0]['id']])
+
+    def test_timeout(self):
+        """
+        Nothing happening in the game ends the wait after the timeout
+        """
+        since = self.game.last_applied_gamelog
+        data = self.client.get('/game/games/{0}/wait/'.format(self.game.pk), {'since': since, 'timeout': 0.05}).data
+        self.assertTrue(data['timed_out'])
+        self.assertEqual(data['gamelogs'], [])
+        self.assertEqual(data['deltas'], [])
+        for timeout in ('soon', 'nan', 'inf', '-1'):
+            response = self.client.get('/game/games/{0}/wait/'.format(self.game.pk), {'timeout': timeout})
+            self.assertEqual(response.status_code, 400)
+
+    def test_invalid_since(self):
+        """
+        since has to be a GameLog id, which is never negative
+        """
+        for since in ('latest', '-1'):
+            response = self.client.get('/game/games/{0}/wait/'.format(self.game.pk), {'since': since, 'timeout': 0})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('since', response.data)
+
+    def test_notify_wakes_waiters(self):
+        """
+        Entries added in the same process wake the waiters without waiting for the next poll
+        """
+        notifier = GameLogNotifier(poll_interval=10)
+        latest = {'id': 0}
+        result = {}
+
+        def waiter():
+            started = time.time()
+            result['changed'] = notifier.wait(1, 0, 10, lambda: latest['id'])
+            result['elapsed'] = time.time() - started
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.05)
+        latest['id'] = 5
+        notifier.notify(1, 5)
+        thread.join(10)
+        self.assertTrue(result['changed'])
+        self.assertLess(result['elapsed'], 5)
+
+
+class GameCommandBatchTests(TestCase):
+    def setUp(self):
+        random.seed('batch')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+        self.seat = self.game.action_seat
+        self.client.force_login(self.seat.player)
+        self.url = '/game/games/{0}/commands/'.format(self.game.pk)
+
+    def test_check_commands_leaves_game_alone(self):
+        """
+        Checking a batch applies it to a copy, and the game itself doesn't change
+        """
+        before = gamestate_summary(self.game)
+        checked = self.game.check_commands(['place prior to use h01 to choose clay', 'pass'], executor=self.seat)
+        self.assertEqual(gamestate_summary(self.game), before)
+        checked_seat = [s for s in checked.seats if s.pk == self.seat.pk][0]
+        self.assertIsNot(checked_seat, self.seat)
+        self.assertEqual(checked_seat.goods['clay'].count, self.seat.goods['clay'].count + 2)
+        self.assertNotEqual(checked.action_seat_index, self.game.action_seat_index)
+
+    def test_batch_added(self):
+        """
+        A batch that applies gets added as one GameLog entry per command
+        """
+        response = self.client.post(self.url, '{"commands": ["place prior to use h01 to choose clay", "pass"]}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([g['command'] for g in response.data['gamelogs']],
+                         ['place prior to use h01 to choose clay', 'pass'])
+        self.assertEqual(response.data['last_applied_gamelog'], response.data['gamelogs'][-1]['id'])
+
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual([g.executor_id for g in game.gamelogs[-2:]], [self.seat.pk, self.seat.pk])
+        self.assertNotEqual(game.action_seat_index, self.game.action_seat_index)
+
+    def test_failing_command(self):
+        """
+        A failing command is reported by index and nothing gets added
+        """
+        gamelog_count = GameLog.objects.filter(game=self.game).count()
+        response = self.client.post(self.url, '{"commands": ["place prior to use h01 to choose clay", "pass", "pass"]}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['index'], 2)
+        self.assertEqual(response.data['error'], 'InvalidActor')
+        self.assertEqual(GameLog.objects.filter(game=self.game).count(), gamelog_count)
+
+    def test_dry_run(self):
+        """
+        A dry run only checks the batch
+        """
+        gamelog_count = GameLog.objects.filter(game=self.game).count()
+        response = self.client.post(self.url, '{"commands": ["place prior to use h01 to choose clay"], '
+                                              '"dry_run": true}', content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['gamelogs'], [])
+        self.assertEqual(GameLog.objects.filter(game=self.game).count(), gamelog_count)
+
+    def test_not_playing(self):
+        self.client.force_login(create_user(username='spectator'))
+        response = self.client.post(self.url, '{"commands": ["pass"]}', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(self.url, '{"commands": []}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CompactFormatTests(TestCase):
+    def setUp(self):
+        random.seed('compact')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+        play_turns(self.game, 3)
+        self.url = '/game/games/{0}/'.format(self.game.pk)
+
+    def test_compact_game(self):
+        """
+        The compact format holds the same state as the JSON one, with names replaced by positions in its tables
+        """
+        response = self.client.get(self.url, {'format': 'compact'})
+        self.assertEqual(response['Content-Type'], 'application/vnd.oel.compact+json')
+        data = json.loads(response.content.decode('utf-8'))
+        tables = data['tables']
+
+        self.assertEqual(dict(zip(tables['tokens'], data['gameboard'])),
+                         {t: self.game.gameboard.get(t) for t in tables['tokens']})
+        seat = self.game.seats[0]
+        row = dict(zip(tables['columns']['seats'], data['seats'][0]))
+        self.assertEqual({name: count for name, count in zip(tables['goods'], row['goods']) if count is not None},
+                         {g.name: g.count for g in seat.goods.values()})
+
+        space = seat.find_spaces_matching(lambda s: s.card and getattr(s.card, 'assigned_clergy', None)).pop()
+        cells = [cell for l in row['landscapes'] for column in l[3] for cell in column if cell]
+        self.assertIn([tables['plots'].index(space.landscape_plot), [space.card.id, [['prior', seat.pk]]]], cells)
+
+        ledger = [(e[0], ' '.join(t for t in (tables['ledger_codes'][e[1]], e[2]) if t)) for e in data['ledger']]
+        self.assertEqual(ledger, [(e.executor_index, e.text) for e in self.game.ledger[data['ledger_start']:]])
+
+    def test_accept_header(self):
+        """
+        The format can be picked with the Accept header too, and doesn't share ETags with the JSON format
+        """
+        compact = self.client.get(self.url, HTTP_ACCEPT='application/vnd.oel.compact+json')
+        self.assertEqual(json.loads(compact.content.decode('utf-8'))['format'], 1)
+        full = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertIn('seats', full.data)
+        self.assertNotEqual(compact['ETag'], full['ETag'])
+        self.assertLess(len(compact.content) * 5, len(full.content))
+
+
+class GameLobbyTests(TestCase):
+    def setUp(self):
+        random.seed('lobby')
+        game_cache.clear()
+        self.started, self.users = create_and_begin_game(2, Variant.France, GameOptions())
+        self.started.build_gamestate()
+        self.open_games = [Game.objects.create_game(3, Variant.Ireland, GameOptions(), owner=self.users[0])
+                           for i in range(2)]
+        self.open_games[0].join(self.users[0])
+
+    def test_joinable(self):
+        """
+        The lobby is a page of an aggregate query, whatever the games' state
+        """
+        with self.assertNumQueries(2):
+            data = self.client.get('/game/games/joinable/').data
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([(g['id'], g['open_seats']) for g in data['results']],
+                         [(self.open_games[1].pk, 3), (self.open_games[0].pk, 2)])
+
+        self.client.force_login(self.users[0])
+        data = self.client.get('/game/games/joinable/').data
+        self.assertEqual([g['id'] for g in data['results']], [self.open_games[1].pk])
+
+    def test_can_join_without_replay(self):
+        """
+        Joining and starting are decided from the summary and the seats
+        """
+        game = Game.objects.get(pk=self.open_games[0].pk)
+        self.assertTrue(game.can_join(self.users[1]))
+        self.assertFalse(game.can_join(self.users[0]))
+        self.assertFalse(game.can_start)
+        game.join(self.users[1])
+        self.assertFalse(Game.objects.get(pk=self.started.pk).can_join(create_user(username='late')))
+        self.assertFalse(game.is_gamestate_loaded)
+
+
+class GameSeatOrderTests(TestCase):
+    def setUp(self):
+        random.seed('seats')
+        game_cache.clear()
+
+    def test_randomized_seats(self):
+        """
+        The seats are sorted and indexed once, and again when 'setup finalize' shuffles them
+        """
+        options = GameOptions()
+        options.add('randomize-seats')
+        game, users = create_and_begin_game(4, Variant.France, options)
+        game.build_gamestate()
+        seats = game.seats
+        self.assertIs(game.seats, seats)
+        self.assertEqual([s.seat_order for s in seats], [1, 2, 3, 4])
+        self.assertNotEqual([s.pk for s in seats], sorted(s.pk for s in seats))
+        self.assertEqual([game.seat_index(s.pk) for s in seats], [0, 1, 2, 3])
+        self.assertEqual([game.seat_by_color(c) for c in ('red', 'green', 'blue', 'white')], seats)
+        self.assertIsNone(game.seat_by_color('black'))
+        self.assertIsNone(game.seat_index(-1))
+
+        # Snapshots carry the seat order too
+        GameSnapshot.objects.create(game=game, gamelog_id=game.last_applied_gamelog, state=dump_gamestate(game))
+        restored = Game.objects.get(pk=game.pk)
+        restored.build_gamestate()
+        self.assertEqual([s.pk for s in restored.seats], [s.pk for s in seats])
+
+    def test_bulk_build(self):
+        """
+        Building a batch of games reads them in the same number of queries however many there are
+        """
+        pks = []
+        for i in range(4):
+            owner = create_user(username='owner_{0}'.format(i))
+            game = Game.objects.create_game(2, Variant.Ireland, GameOptions(), owner=owner)
+            pks.append(game.pk)
+        with self.assertNumQueries(6):
+            self.assertEqual([g.pk for g in GameCache().get_many(pks[:2] + [-1])], pks[:2])
+        with self.assertNumQueries(6):
+            games = GameCache().get_many(pks)
+        self.assertEqual([g.number_of_players for g in games], [2, 2, 2, 2])
+
+
+class GameCommandQueueTests(TestCase):
+    def setUp(self):
+        random.seed('queue')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.Ireland, GameOptions())
+        self.game.build_gamestate()
+        self.queues = CommandQueues()
+
+    def test_batches_applied_in_order(self):
+        """
+        Queued batches are applied one after the other on the cached game, and a failing one only fails itself
+        """
+        seat = self.game.action_seat
+        first = self.queues.submit(self.game.pk, ['place prior to use h01 to choose clay', 'pass'],
+                                   executor_id=seat.pk, start_worker=False)
+        # Not this seat's turn anymore by the time it gets applied
+        second = self.queues.submit(self.game.pk, ['pass'], executor_id=seat.pk, start_worker=False)
+        next_seat = self.game.seats[(self.game.action_seat_index + 1) % 3]
+        third = self.queues.submit(self.game.pk, ['# still going'], executor_id=next_seat.pk, start_worker=False)
+        self.assertFalse(first.done())
+        self.assertIn(self.game.pk, self.queues)
+        self.assertEqual(self.queues.process_pending(), 3)
+        # Nothing is kept around for games with nothing queued
+        self.assertNotIn(self.game.pk, self.queues)
+
+        self.assertEqual([g.command for g in first.result()], ['place prior to use h01 to choose clay', 'pass'])
+        with self.assertRaises(CommandBatchError) as raised:
+            second.result()
+        self.assertEqual(raised.exception.index, 0)
+        game = game_cache.get(self.game.pk)
+        self.assertEqual(game.last_applied_gamelog, third.result()[-1].id)
+        self.assertEqual(game.action_seat, next_seat)
+
+    def test_conflict_caught_up(self):
+        """
+        Commands written around the queue are caught up with before applying the batch
+        """
+        game_cache.get(self.game.pk)
+        play_turns(self.game, 1)
+        future = self.queues.submit(self.game.pk, [next_turn(self.game)], executor_id=self.game.action_seat.pk,
+                                    start_worker=False)
+        self.queues.process_pending()
+        self.assertEqual(game_cache.get(self.game.pk).last_applied_gamelog, future.result()[0].id)
+
+    def test_future_timeout(self):
+        """
+        A batch that timed out in the queue never gets applied; one that's already being applied gets waited for
+        """
+        future = self.queues.submit(self.game.pk, ['# too slow'], executor_id=self.game.action_seat.pk,
+                                    start_worker=False)
+        with self.assertRaises(CommandQueueTimeout):
+            future.result(0.01)
+        self.assertEqual(self.queues.process_pending(), 0)
+
+        future = CommandFuture()
+        with self.assertRaises(CommandQueueTimeout):
+            future.result(0.01)
+        threading.Timer(0.01, future.set_result, [['done']]).start()
+        self.assertEqual(future.result(5), ['done'])
+
+        # Taken off the queue by the worker in the meantime
+        future = CommandFuture(GameCommandQueue(self.game.pk))
+        threading.Timer(0.05, future.set_result, [['applied']]).start()
+        self.assertEqual(future.result(0.01), ['applied'])
+
+
+class GameArchiveTests(TestCase):
+    def setUp(self):
+        random.seed('archive')
+        game_cache.clear()
+        self.game, self.users = create_and_begin_game(3, Variant.France, GameOptions())
+        self.game.build_gamestate()
+        play_turns(self.game, 8)
+
+    def finish_game(self):
+        # Playing a whole game takes too long, so the end is skipped to.  The snapshot makes loads end up there too.
+        self.game.phase = Phase.Endgame
+        self.game.update_summary()
+        self.game.save_snapshot()
+
+    def test_archive_matches_gamelog(self):
+        """
+        An archived game loads the same GameLog entries and gamestate as before, without any GameLog rows left
+        """
+        self.finish_game()
+        stale = Game.objects.get(pk=self.game.pk)
+        stale.build_gamestate()
+        commands = [(g.id, g.seq, g.executor_id, g.command) for g in self.game.gamelogs]
+        archive = self.game.archive()
+        self.assertEqual(archive.gamelog_count, len(commands))
+        self.assertFalse(GameLog.objects.filter(game=self.game).exists())
+        self.assertFalse(GameSnapshot.objects.filter(game=self.game).exists())
+
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual([(g.id, g.seq, g.executor_id, g.command) for g in game.gamelogs], commands)
+        self.assertEqual(gamestate_summary(game), gamestate_summary(self.game))
+        self.assertEqual(game.last_applied_gamelog, commands[-1][0])
+        with self.assertRaises(GameArchived):
+            game.add_command('# too late')
+
+        # Copies from before the archive can neither bring the GameLog back nor add to it
+        self.assertFalse(stale.archived)
+        stale.name = 'Renamed'
+        stale.save()
+        with self.assertRaises(GameArchived):
+            stale.add_command('# too late')
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertTrue(game.archived)
+        self.assertEqual(game.name, 'Renamed')
+        self.assertEqual(len(game.gamelogs), len(commands))
+
+        # Cached archived games don't get reloaded just because their GameLog rows are gone
+        game_cache.get(self.game.pk)
+        game_cache.get(self.game.pk)
+        self.assertEqual((game_cache.hits, game_cache.misses), (1, 1))
+
+    def test_archive_requires_endgame(self):
+        with self.assertRaises(ValueError):
+            self.game.archive()
+        self.assertFalse(Game.objects.get(pk=self.game.pk).archived)
+
+    def test_archive_games_command(self):
+        self.finish_game()
+        other = Game.objects.create_game(2, Variant.Ireland, GameOptions(), owner=self.users[0])
+        out = StringIO()
+        call_command('archive_games', stdout=out)
+        self.assertIn('1 game(s) archived', out.getvalue())
+        self.assertEqual(list(GameArchive.objects.values_list('game_id', flat=True)), [self.game.pk])
+        self.assertTrue(GameLog.objects.filter(game=other).exists())
+
+        games = Game.objects.in_bulk_for_replay([self.game.pk, other.pk])
+        with self.assertNumQueries(0):
+            games[self.game.pk].build_gamestate()
+        self.assertEqual(games[self.game.pk].phase, Phase.Endgame)
+
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        random.seed('plans')
+        self.game, self.users = create_and_begin_game(2, Variant.Ireland, GameOptions())
+
+    def test_hot_queries_use_indexes(self):
+        """
+        Reading a game's GameLog, joining a seat and the owner/player lookups are all served by indexes
+        """
+        gamelogs = self.game.gamelog_set
+        assert_uses_index(gamelogs.all(), ordered=True)
+        assert_uses_index(gamelogs.reverse()[:1], ordered=True)
+        assert_uses_index(gamelogs.filter(id__gt=self.game.gamelogs[2].id), ordered=True)
+        assert_uses_index(self.game.seat_set.players().select_for_update().filter(player__isnull=True)[:1])
+        assert_uses_index(self.game.seat_set.players().filter(player=self.users[0]))
+        assert_uses_index(Game.objects.filter(owner=self.users[0]))
+        assert_uses_index(Seat.objects.filter(player=self.users[0]))
+
+    def test_scans_caught(self):
+        with self.assertRaises(AssertionError):
+            assert_uses_index(GameLog.objects.filter(command='pass'))
+        with self.assertRaises(AssertionError):
+            assert_uses_index(self.game.gamelog_set.order_by('command'), ordered=True)
@@ -14,6 +14,7 @@ app_name = 'game'
 urlpatterns = [
     url(r'^$', views.IndexView.as_view(), name='index'),
     url(r'^', include(router.urls)),
+    url(r'^cards/$', views.CardCatalogView.as_view(), name='cards'),
     url(r'^(?P<pk>\d+)/$', views.GameDetailView.as_view(), name='detail'),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
\ No newline at end of file
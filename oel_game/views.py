@@ -1,10 +1,162 @@
+import math
+
+from django.conf import settings
+from django.http import Http404
+from django.utils import six
+from django.utils.decorators import method_decorator
 from django.views import generic
-from rest_framework import viewsets
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
+from django.views.decorators.vary import vary_on_headers
+from rest_framework import status, viewsets
 from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import NotAuthenticated, PermissionDenied, ValidationError
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
+from .cache import GameCache, game_cache
+from .exceptions import CommandBatchError, CommandQueueTimeout, GameArchived, UnappliedCommandsError
 from .models import Game
-from .serializers import GameSerializer
+from .notifications import gamelog_notifier
+from .queues import command_queues
+from .renderers import CompactJSONRenderer
+from .serializers import CARD_CATALOG_VERSION, COMPACT_FORMAT_VERSION, GAME_SERIALIZER_VERSION, card_catalog, \
+    CompactGameSerializer, GameSerializer, GameSummarySerializer, GameLogSerializer, LedgerEntrySerializer, \
+    LobbyGameSerializer
+
+# Largest page the gamelogs/ and ledger/ sub-resources hand out
+MAX_ENTRY_LIMIT = 500
+# Longest a wait/ request is held open, in seconds
+MAX_WAIT_TIMEOUT = 30
+# Most commands accepted in one batch
+MAX_BATCH_SIZE = 50
+# Longest a request waits for its batch to come out of the game's command queue, in seconds
+COMMAND_QUEUE_TIMEOUT = 30
+
+
+def summary_queryset(queryset):
+    """
+    Joins what GameSummarySerializer shows, so a page of summaries is a single query
+    """
+    return queryset.select_related('owner', 'summary_action_seat__player')
+
+
+def game_etag(request, pk=None, *args, **kwargs):
+    """
+    The newest GameLog id, the number of seats taken and the time the game was last saved identify what the game looks
+    like (see GameManager.versions()).  They're read in a single query, without building the game.
+    :return: ETag for the game's detail representation, or None if there's no such game
+    """
+    try:
+        version = Game.objects.versions([pk]).get(int(pk))
+    except (ValueError, TypeError):
+        return None
+    if version is None:
+        return None
+    version = '{0}-{1}-{2}-{3:%Y%m%d%H%M%S%f}'.format(pk, version[0], version[1], version[2])
+    # The compact format and the browsable API are different representations of the same state, served from the same
+    # URL, so each gets its own tag (and the response varies on Accept)
+    requested_format = request.GET.get('format')
+    accept = request.META.get('HTTP_ACCEPT', '')
+    if requested_format == CompactJSONRenderer.format or \
+            (requested_format is None and CompactJSONRenderer.media_type in accept):
+        return '{0}-c{1}'.format(version, COMPACT_FORMAT_VERSION)
+    if requested_format == 'api' or (requested_format is None and 'text/html' in accept):
+        return '{0}-{1}-html'.format(version, GAME_SERIALIZER_VERSION)
+    return '{0}-{1}'.format(version, GAME_SERIALIZER_VERSION)
+
+
+def window_params(request, default_limit=100):
+    """
+    :return: (since, limit) from the query string
+    """
+    params = {}
+    for name, default in (('since', 0), ('limit', default_limit)):
+        try:
+            params[name] = int(request.query_params.get(name, default))
+        except ValueError:
+            raise ValidationError({name: 'must be an integer'})
+        if params[name] < 0:
+            raise ValidationError({name: 'must not be negative'})
+    # An empty page has no cursor to carry on from
+    if params['limit'] < 1:
+        raise ValidationError({'limit': 'must be at least 1'})
+    return params['since'], min(params['limit'], MAX_ENTRY_LIMIT)
+
+
+def since_param(request):
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        raise ValidationError({'since': 'must be a GameLog id'})
+    if since < 0:
+        raise ValidationError({'since': 'must be a GameLog id'})
+    return since
+
+
+def timeout_param(request):
+    """
+    :return: ?timeout= in seconds, at most MAX_WAIT_TIMEOUT
+    """
+    try:
+        timeout = float(request.query_params.get('timeout', MAX_WAIT_TIMEOUT))
+    except ValueError:
+        raise ValidationError({'timeout': 'must be a number of seconds'})
+    # math.isfinite() is Python 3 only
+    if math.isnan(timeout) or math.isinf(timeout) or timeout < 0:
+        raise ValidationError({'timeout': 'must be a number of seconds'})
+    return min(timeout, MAX_WAIT_TIMEOUT)
+
+
+def deltas_data(game, since):
+    """
+    :return: what changed in the game since the GameLog entry with id since.  If the changes aren't all known, 'reset'
+    is set and the client has to fetch the full game again.
+    """
+    deltas = game.deltas_since(since)
+    return {
+        'since': since,
+        'last_applied_gamelog': game.last_applied_gamelog,
+        'phase': game.phase,
+        'reset': deltas is None,
+        'deltas': [dict(delta, gamelog_id=gamelog_id) for gamelog_id, delta in deltas or ()]
+    }
+
+
+def executor_seat(request, game):
+    """
+    :return: the requesting user's seat in the game.  A user with several seats acts for the one whose turn it is.
+    """
+    if not request.user.is_authenticated():
+        raise NotAuthenticated()
+    seats = [s for s in game.seats if s.player_id == request.user.id]
+    if not seats:
+        raise PermissionDenied('You are not playing in this game')
+    return game.action_seat if game.action_seat in seats else seats[0]
+
+
+class LobbyPagination(LimitOffsetPagination):
+    default_limit = 20
+    max_limit = 100
+
+
+def cached_game(pk):
+    """
+    :return: the built game from the cache.  The caller has to hold game_lock(pk) while using it.
+    """
+    try:
+        return game_cache.get(pk)
+    except (Game.DoesNotExist, ValueError, TypeError):
+        raise Http404('No game matches the given query.')
+
+
+def game_lock(pk):
+    try:
+        return game_cache.game_lock(pk)
+    except (ValueError, TypeError):
+        raise Http404('No game matches the given query.')
 
 
 class IndexView(generic.ListView):
@@ -12,26 +164,227 @@ class IndexView(generic.ListView):
 
     def get_queryset(self):
         """Return the last five games."""
-        return Game.objects.filter(
-        ).order_by('-id')[:5]
+        return summary_queryset(Game.objects.filter(
+        ).order_by('-id')[:5])
 
 
+@method_decorator(etag(game_etag), name='dispatch')
 class GameDetailView(generic.DetailView):
     model = Game
 
     def get_queryset(self):
         return Game.objects.filter()
 
+    def get(self, request, *args, **kwargs):
+        # The template reads the cached game, so it gets rendered before letting go of it
+        with game_lock(self.kwargs.get(self.pk_url_kwarg)):
+            return super(GameDetailView, self).get(request, *args, **kwargs).render()
+
+    def get_object(self, queryset=None):
+        return cached_game(self.kwargs.get(self.pk_url_kwarg))
+
+
+def card_catalog_etag(request, *args, **kwargs):
+    return 'cards-{0}'.format(CARD_CATALOG_VERSION)
+
+
+@method_decorator(cache_control(public=True, max_age=24 * 60 * 60), name='dispatch')
+@method_decorator(etag(card_catalog_etag), name='dispatch')
+class CardCatalogView(APIView):
+    """
+    Static data of every card, keyed by card id.  Games refer to cards by id and carry the catalog version they match.
+    """
+    def get(self, request, format=None):
+        return Response({
+            'version': CARD_CATALOG_VERSION,
+            'cards': card_catalog()
+        })
+
 
 class GameViewSet(viewsets.ModelViewSet):
     serializer_class = GameSerializer
-    queryset = Game.objects.all()
+    queryset = Game.objects.for_replay()
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [CompactJSONRenderer]
+
+    def dispatch(self, request, *args, **kwargs):
+        self.game_locks = []
+        try:
+            return super(GameViewSet, self).dispatch(request, *args, **kwargs)
+        finally:
+            self.release_game()
+
+    @method_decorator(vary_on_headers('Accept'))
+    @method_decorator(etag(game_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super(GameViewSet, self).retrieve(request, *args, **kwargs)
+
+    def get_object(self):
+        """
+        :return: the cached game.  Its lock is held until the request is done, or until release_game().
+        """
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        lock = game_lock(pk)
+        lock.acquire()
+        self.game_locks.append(lock)
+        game = cached_game(pk)
+        self.check_object_permissions(self.request, game)
+        return game
+
+    def release_game(self):
+        """
+        Lets go of the game before blocking, so that others can use it in the meantime
+        """
+        while self.game_locks:
+            self.game_locks.pop().release()
+
+    def get_queryset(self):
+        if self.action in ('list', 'latest'):
+            queryset = Game.objects.all()
+            awaiting = self.request.query_params.get('awaiting')
+            if awaiting is not None:
+                if awaiting != 'me':
+                    raise ValidationError({'awaiting': 'only "me" is supported'})
+                if not self.request.user.is_authenticated():
+                    return queryset.none()
+                queryset = Game.objects.awaiting(self.request.user)
+            return summary_queryset(queryset)
+        return self.queryset
+
+    def get_serializer_class(self):
+        # Listings only show the summary, which never needs the gamestate to be built
+        if self.action in ('list', 'latest'):
+            return GameSummarySerializer
+        if self.action == 'retrieve' and getattr(self.request, 'accepted_renderer', None) and \
+                self.request.accepted_renderer.format == CompactJSONRenderer.format:
+            return CompactGameSerializer
+        return self.serializer_class
+
+    @detail_route()
+    def deltas(self, request, pk=None):
+        """
+        Returns what changed in the game since the GameLog entry given by ?since=.  If the changes aren't all known,
+        'reset' is set and the client has to fetch the full game again.
+        """
+        since = since_param(request)
+        return Response(deltas_data(self.get_object(), since))
+
+    @detail_route()
+    def wait(self, request, pk=None):
+        """
+        Holds the request until the game has GameLog entries newer than ?since=, or until ?timeout= seconds have
+        passed.  Returns the new entries along with the deltas; 'timed_out' is set if nothing happened.
+        """
+        since = since_param(request)
+        timeout = timeout_param(request)
+        game = self.get_object()
+        self.release_game()
+
+        changed = gamelog_notifier.wait(game.pk, since, timeout,
+                                        lambda: GameCache.latest_gamelog_ids([game.pk]).get(game.pk, 0))
+        game = self.get_object()
+        data = deltas_data(game, since)
+        data['timed_out'] = not changed
+        data['gamelogs'] = GameLogSerializer([g for g in game.gamelogs if g.id > since][:MAX_ENTRY_LIMIT],
+                                             many=True).data
+        return Response(data)
+
+    @detail_route()
+    def gamelogs(self, request, pk=None):
+        """
+        Returns up to ?limit= GameLog entries after the entry with id ?since=.  'next_since' is the cursor for the
+        following page, or None if there isn't one.
+        """
+        since, limit = window_params(request)
+        game = self.get_object()
+        gamelogs = [g for g in game.gamelogs if g.id > since]
+        page = gamelogs[:limit]
+        return Response({
+            'count': len(game.gamelogs),
+            'results': GameLogSerializer(page, many=True).data,
+            'next_since': page[-1].id if len(gamelogs) > limit else None
+        })
+
+    @detail_route()
+    def ledger(self, request, pk=None):
+        """
+        Returns up to ?limit= ledger entries, starting at index ?since=.  'next_since' is the cursor for the following
+        page, or None if there isn't one.
+        """
+        since, limit = window_params(request)
+        game = self.get_object()
+        page = game.ledger[since:since + limit]
+        return Response({
+            'count': len(game.ledger),
+            'start': since,
+            'results': LedgerEntrySerializer(page, many=True).data,
+            'next_since': since + limit if since + limit < len(game.ledger) else None
+        })
+
+    @detail_route(methods=['post'])
+    def commands(self, request, pk=None):
+        """
+        Adds a batch of commands as the requesting player, all or nothing.  The batch is checked against a copy of the
+        game first; if a command fails, nothing is added and 'index' says which one.  With 'dry_run' set the batch is
+        only checked.
+        """
+        commands = request.data.get('commands')
+        if not isinstance(commands, list) or not commands or \
+                not all(isinstance(c, six.string_types) and c.strip() for c in commands):
+            raise ValidationError({'commands': 'must be a list of command strings'})
+        if len(commands) > MAX_BATCH_SIZE:
+            raise ValidationError({'commands': 'at most {0} commands at a time'.format(MAX_BATCH_SIZE)})
+        dry_run = request.data.get('dry_run') in (True, 'true', '1')
+
+        game = self.get_object()
+        executor = executor_seat(request, game)
+        try:
+            if getattr(settings, 'OEL_COMMAND_QUEUE', False) and not dry_run:
+                # Batches for the same game get applied one after the other by the game's queue, instead of racing
+                future = command_queues.submit(game.pk, commands, executor_id=executor.pk)
+                # The queue's worker needs the game too
+                self.release_game()
+                gamelogs = future.result(COMMAND_QUEUE_TIMEOUT)
+                game = self.get_object()
+            else:
+                gamelogs = game.submit_commands(commands, executor=executor, dry_run=dry_run)
+        except CommandBatchError as error:
+            return Response({
+                'index': error.index,
+                'command': commands[error.index],
+                'error': type(error.error).__name__,
+                'detail': six.text_type(error.error)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except UnappliedCommandsError:
+            return Response({'detail': 'The game has changed, fetch it again'}, status=status.HTTP_409_CONFLICT)
+        except GameArchived:
+            return Response({'detail': 'The game has been archived'}, status=status.HTTP_409_CONFLICT)
+        except CommandQueueTimeout:
+            # The batch was taken off the queue, so trying again can't add it twice
+            return Response({'detail': 'The game is busy and nothing was added, try again'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return Response({
+            'dry_run': dry_run,
+            'last_applied_gamelog': game.last_applied_gamelog,
+            'gamelogs': GameLogSerializer(gamelogs, many=True).data
+        }, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
+    @list_route()
+    def joinable(self, request):
+        """
+        Games that are still looking for players, newest first and a page at a time.  Games the requesting user has
+        already joined are left out.
+        """
+        user = request.user if request.user.is_authenticated() else None
+        queryset = Game.objects.joinable(user).select_related('owner').order_by('-id')
+        paginator = LobbyPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(LobbyGameSerializer(page, many=True).data)
 
     @list_route()
     def latest(self, request):
         """Return the last five published questions."""
-        questions = Game.objects.filter(
-        ).order_by('-id')[:5]
+        questions = self.get_queryset().order_by('-id')[:5]
 
         page = self.paginate_queryset(questions)
         if page is not None:
@@ -39,4 +392,4 @@ class GameViewSet(viewsets.ModelViewSet):
             return self.get_paginated_response(serializer.data)
 
         serializer = self.get_serializer(questions, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)